@@ -17,7 +17,8 @@ setup(
         'requests',
         'requests-oauthlib',
         'SQLAlchemy',
-        'progressbar2',
-    ],
+    ], extras_require={
+        'fast': ['orjson', 'numpy'],
+    },
     python_requires='>=3.8'
 )
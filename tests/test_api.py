@@ -0,0 +1,130 @@
+import asyncio
+import gzip
+import os
+import tempfile
+import unittest
+from unittest.mock import patch, MagicMock
+
+from vkinder.api import VKApi, AsyncVKApi
+from vkinder.exceptions import InvalidUserID, CassetteError
+from vkinder.ratelimit import TokenPool
+from vkinder.transport import LocalTransport, RecordingTransport, ReplayTransport
+
+API_URL = 'https://api.vk.test/method'
+VERSION = '5.103'
+mock_print = MagicMock()
+
+
+class FakeVK:
+    """A tiny in-process VK API endpoint."""
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, method, params):
+        self.calls.append((method, params))
+
+        if params['access_token'] == 'revoked':
+            return {'error': {'error_code': 5, 'error_msg': 'User authorization failed'}}
+
+        if method == 'users.get':
+            if params.get('user_ids') == 'nobody':
+                return {'error': {'error_code': 113, 'error_msg': 'Invalid user id'}}
+            return {'response': [{'id': 1, 'first_name': 'Test', 'last_name': 'User'}]}
+        if method == 'groups.get':
+            return {'response': {'count': 2, 'items': [10, 20]}}
+        if method == 'execute':
+            return {'response': [{'count': 2, 'items': [10, 20]}, False],
+                    'execute_errors': [{'method': 'photos.get', 'error_code': 30,
+                                        'error_msg': 'This profile is private'}]}
+
+        return {'error': {'error_code': 3, 'error_msg': 'Unknown method passed'}}
+
+
+@patch('vkinder.api.clean_screen', MagicMock())
+@patch('builtins.print', mock_print)
+class VKApiTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.vk = FakeVK()
+        self.api = VKApi(API_URL, VERSION, debug=False,
+                         transport=LocalTransport(self.vk),
+                         pool=TokenPool(['test_token'], rate=1000))
+
+    def tearDown(self) -> None:
+        self.api.close()
+
+    def test_request_goes_through_transport(self):
+        groups = self.api.groups.get(user_id=1)
+
+        self.assertEqual(groups['items'], [10, 20], 'Response is unwrapped')
+        method, params = self.vk.calls[-1]
+        self.assertEqual(method, 'groups.get')
+        self.assertEqual(params['access_token'], 'test_token', 'Token is sent')
+        self.assertEqual(params['v'], VERSION, 'API version is sent')
+
+    def test_error_mapping(self):
+        with self.assertRaises(InvalidUserID):
+            self.api.users.get(user_ids='nobody')
+
+    def test_token_rotation(self):
+        api = VKApi(API_URL, VERSION, debug=False,
+                    transport=LocalTransport(self.vk),
+                    pool=TokenPool(['revoked', 'test_token'], rate=1000))
+
+        for _ in range(3):
+            api.groups.get(user_id=1)
+
+        self.assertEqual(api.pool.tokens, ['test_token'], 'Rejected token is retired')
+        self.assertEqual(self.vk.calls[-1][1]['access_token'], 'test_token')
+
+    def test_execute_errors(self):
+        with self.api.coalesce() as batch:
+            groups = batch.add('groups.get', user_id=1)
+            photos = batch.add('photos.get', owner_id=1)
+
+        self.assertEqual(groups.result['items'], [10, 20])
+        self.assertIsNone(photos.result, 'Failed call resolves to None')
+        self.assertEqual(self.api.metrics.errors[('photos.get', '30')], 1,
+                         'Errors of calls inside execute are counted')
+        self.assertEqual([method for method, _ in self.vk.calls].count('execute'), 1,
+                         "Errors that aren't retryable are not retried")
+
+    def test_record_replay(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cassette = os.path.join(directory, 'run.jsonl.gz')
+
+            recorder = VKApi(API_URL, VERSION, debug=False,
+                             transport=RecordingTransport(LocalTransport(self.vk), cassette),
+                             pool=TokenPool(['test_token'], rate=1000))
+            recorded = recorder.groups.get(user_id=1)
+            recorder.close()
+
+            with gzip.open(cassette, 'rb') as f:
+                self.assertNotIn(b'test_token', f.read(), 'Token is not recorded')
+
+            player = VKApi(API_URL, VERSION, debug=False,
+                           transport=ReplayTransport(cassette),
+                           pool=TokenPool(['other_token'], rate=1000))
+
+            self.assertEqual(player.groups.get(user_id='1'), recorded,
+                             'Response is replayed without the endpoint')
+            with self.assertRaises(CassetteError):
+                player.groups.get(user_id=2)
+
+    def test_async_surface(self):
+        aio = AsyncVKApi(self.api)
+
+        async def fetch():
+            return await asyncio.gather(aio.groups.get(user_id=1),
+                                        aio.users.get(user_ids=1))
+
+        groups, users = asyncio.run(fetch())
+        aio.close()
+
+        self.assertEqual(groups['items'], [10, 20], 'Coroutine returns the same response')
+        self.assertEqual(users[0]['id'], 1, 'Results are kept in order')
+
+
+if __name__ == '__main__':
+    unittest.main()
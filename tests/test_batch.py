@@ -0,0 +1,167 @@
+import asyncio
+import json
+import os
+import re
+import tempfile
+import unittest
+
+from vkinder.batch import Coalescer, AsyncCoalescer
+from vkinder.cache import ResponseCache, TTL
+from vkinder.metrics import Metrics
+from vkinder.retry import RetryPolicy
+
+
+class FakeExecute:
+    """Runs the calls of a compiled VKScript against canned results."""
+
+    def __init__(self, failures=None):
+        self.scripts = []
+        # user_id -> error codes `groups.get` fails with, one per call
+        self.failures = failures or {}
+
+    def __call__(self, code):
+        self.scripts.append(code)
+        calls = re.findall(r'API\.([\w.]+)\((\{.*?\})\)', code)
+        response, errors = [], []
+        for method, params in calls:
+            result, error = self.call(method, json.loads(params))
+            response.append(result)
+            if error:
+                errors.append({'method': method, 'error_code': error, 'error_msg': 'Error'})
+        return {'response': response, 'execute_errors': errors}
+
+    def call(self, method, params):
+        if method == 'groups.get':
+            if failures := self.failures.get(params['user_id']):
+                return False, failures.pop(0)
+            return {'count': 1, 'items': [params['user_id'] * 10]}, None
+        return False, 100
+
+
+class FakeApi:
+    def __init__(self, execute, cache=None):
+        self.other = self
+        self.v = '5.103'
+        self.cache = cache
+        self.metrics = Metrics()
+        self.retry = RetryPolicy(attempts=3, base_delay=0)
+        self._execute = execute
+
+    def execute(self, code):
+        return self._execute(code)
+
+
+class FakeAsyncApi(FakeApi):
+    async def execute(self, code):
+        return self._execute(code)
+
+
+class CoalescerTest(unittest.TestCase):
+
+    def test_batches(self):
+        execute = FakeExecute()
+
+        with Coalescer(FakeApi(execute)) as batch:
+            calls = [batch.add('groups.get', user_id=uid) for uid in range(60)]
+
+        self.assertEqual(len(execute.scripts), 3, '60 calls fit in 3 executes')
+        self.assertTrue(all(call.done for call in calls), 'Every call is resolved')
+        self.assertEqual([call.result['items'][0] for call in calls],
+                         [uid * 10 for uid in range(60)],
+                         'Results are handed back to their calls')
+        self.assertEqual(len(batch), 0, 'Queue is empty after the flush')
+
+    def test_failed_call(self):
+        execute = FakeExecute()
+
+        with Coalescer(FakeApi(execute)) as batch:
+            call = batch.add('photos.get', owner_id=1)
+
+        self.assertTrue(call.done)
+        self.assertIsNone(call.result, 'Failed call resolves to None')
+        self.assertEqual(len(execute.scripts), 1, "Errors that aren't retryable are not retried")
+        self.assertEqual(batch.api.metrics.errors[('photos.get', '100')], 1,
+                         'Errors inside execute are counted')
+
+    def test_retry(self):
+        execute = FakeExecute(failures={1: [6], 2: [10, 9, 6]})
+
+        with Coalescer(FakeApi(execute)) as batch:
+            calls = [batch.add('groups.get', user_id=uid) for uid in range(3)]
+
+        self.assertEqual([call.result and call.result['items'] for call in calls],
+                         [[0], [10], None], 'Calls are retried up to the attempts limit')
+        self.assertEqual(len(execute.scripts), 3)
+        self.assertEqual(execute.scripts[1], 'return [API.groups.get({"user_id": 1}),'
+                                             'API.groups.get({"user_id": 2})];',
+                         'Only failed calls are sent again')
+
+        metrics = batch.api.metrics
+        self.assertEqual(metrics.retries['groups.get'], 3)
+        self.assertEqual(sum(metrics.errors.values()), 4)
+
+    def test_cache(self):
+        now = [1000.0]
+        with tempfile.TemporaryDirectory() as directory:
+            cache = ResponseCache(os.path.join(directory, 'cache.db'),
+                                  ttl={'groups.get': 60, 'photos.get': 3600},
+                                  clock=lambda: now[0])
+            execute = FakeExecute()
+            api = FakeApi(execute, cache)
+
+            with Coalescer(api) as batch:
+                batch.add('groups.get', user_id=1)
+                batch.add('photos.get', owner_id=1)
+            self.assertEqual(cache.size, 0, "Results of an execute with errors aren't cached")
+
+            for _ in range(2):
+                with Coalescer(api) as batch:
+                    call = batch.add('groups.get', user_id=1)
+            self.assertEqual(len(execute.scripts), 2, 'Cached call is not sent')
+            self.assertEqual(call.result['items'], [10])
+            self.assertEqual(api.metrics.cache_hits['groups.get'], 1)
+
+            now[0] += 61
+            with Coalescer(api) as batch:
+                batch.add('groups.get', user_id=1)
+            self.assertEqual(len(execute.scripts), 3, 'Calls expire with the TTL of their method')
+            cache.close()
+
+        self.assertNotIn('execute', TTL, 'Execute replies are never cached as a whole')
+
+    def test_vkscript(self):
+        execute = FakeExecute()
+
+        with Coalescer(FakeApi(execute)) as batch:
+            batch.add('database.getCities', country_id=1, q='Москва')
+
+        self.assertEqual(execute.scripts[0],
+                         'return [API.database.getCities({"country_id": 1, "q": "Москва"})];')
+
+    def test_async(self):
+        execute = FakeExecute()
+
+        async def run():
+            async with AsyncCoalescer(FakeAsyncApi(execute), limit=10) as batch:
+                return [batch.add('groups.get', user_id=uid) for uid in range(25)]
+
+        calls = asyncio.run(run())
+
+        self.assertEqual(len(execute.scripts), 3, 'Batch size limit is respected')
+        self.assertEqual(calls[-1].result['items'], [240])
+
+    def test_async_retry(self):
+        execute = FakeExecute(failures={5: [10]})
+
+        async def run():
+            async with AsyncCoalescer(FakeAsyncApi(execute), limit=10) as batch:
+                return [batch.add('groups.get', user_id=uid) for uid in range(25)]
+
+        calls = asyncio.run(run())
+
+        self.assertEqual(len(execute.scripts), 4, 'Failed call is sent once more')
+        self.assertEqual(calls[5].result['items'], [50])
+
+
+if __name__ == '__main__':
+    unittest.main()
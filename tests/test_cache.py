@@ -0,0 +1,61 @@
+import os
+import tempfile
+import unittest
+
+from vkinder.cache import ResponseCache
+
+
+class ResponseCacheTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.now = 0.0
+        self.dir = tempfile.TemporaryDirectory()
+        self.cache = ResponseCache(os.path.join(self.dir.name, 'cache.db'),
+                                   ttl={'groups.get': 60, 'users.search': 10},
+                                   max_size=2 ** 20,
+                                   clock=lambda: self.now)
+
+    def tearDown(self) -> None:
+        self.cache.close()
+        self.dir.cleanup()
+
+    def test_hit_and_miss(self):
+        params = {'user_id': 1, 'access_token': 'one', 'v': '5.103'}
+        self.cache.put('/groups.get', params, {'count': 1, 'items': [1]})
+
+        same_request = {'v': '5.103', 'user_id': '1', 'access_token': 'two'}
+        self.assertEqual(self.cache.get('/groups.get', same_request), {'count': 1, 'items': [1]},
+                         'Key ignores the token, parameters order and types')
+        self.assertIsNone(self.cache.get('/groups.get', {'user_id': 2}), 'Other parameters miss')
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+    def test_uncached_method(self):
+        self.cache.put('/users.get', {}, [{'id': 1}])
+
+        self.assertIsNone(self.cache.get('/users.get', {}), 'Methods without TTL are not cached')
+
+    def test_ttl(self):
+        self.cache.put('/users.search', {'q': 'a'}, {'items': []})
+        self.now = 11
+
+        self.assertIsNone(self.cache.get('/users.search', {'q': 'a'}), 'Expired response is dropped')
+        self.assertEqual(self.cache.size, 0)
+
+    def test_lru_eviction(self):
+        payload = os.urandom(2 ** 16).hex()
+        self.cache.put('/groups.get', {'user_id': 1}, payload)
+        self.cache.max_size = self.cache.size * 2.5
+        self.now = 1
+        self.cache.put('/groups.get', {'user_id': 2}, payload)
+        self.now = 2
+        self.cache.get('/groups.get', {'user_id': 1})
+        self.now = 3
+        self.cache.put('/groups.get', {'user_id': 3}, payload)
+
+        self.assertIsNotNone(self.cache.get('/groups.get', {'user_id': 1}), 'Recently used is kept')
+        self.assertIsNone(self.cache.get('/groups.get', {'user_id': 2}), 'Least recently used is evicted')
+        self.assertLessEqual(self.cache.size, self.cache.max_size)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,188 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+
+from vkinder.db import AppDB, Photo, db_session
+from vkinder.db import Match as DBMatch
+from vkinder.types import Match
+
+
+def make_match(uid, score=0):
+    match = Match(uid, 'Name', 'Surname', 1,
+                  {'music': ['rock']}, {'political': 1}, [1, 2, 3],
+                  [{'link': f'https://photo/{uid}'}])
+    match.groups_score = score
+    return match
+
+
+class AppDBTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'test.db')
+
+    def tearDown(self) -> None:
+        self.dir.cleanup()
+
+    def test_migrate(self):
+        connection = sqlite3.connect(self.path)
+        connection.execute('CREATE TABLE matches (id INTEGER PRIMARY KEY, uid INTEGER, '
+                           'user_uid INTEGER, name VARCHAR, surname VARCHAR, '
+                           'profile VARCHAR(32), total_score INTEGER, seen BOOLEAN)')
+        connection.close()
+
+        AppDB(self.path)
+
+        connection = sqlite3.connect(self.path)
+        columns = {row[1] for row in connection.execute('PRAGMA table_info(matches)')}
+        connection.close()
+        self.assertIn('fetched_at', columns, 'Missing columns are added to old databases')
+
+    def test_migrate_unique(self):
+        connection = sqlite3.connect(self.path)
+        connection.execute('CREATE TABLE matches (id INTEGER PRIMARY KEY, uid INTEGER, '
+                           'user_uid INTEGER, name VARCHAR, surname VARCHAR, '
+                           'profile VARCHAR(32), total_score INTEGER, seen BOOLEAN)')
+        connection.execute('CREATE TABLE photos (id INTEGER PRIMARY KEY, match_id INTEGER, '
+                           'link VARCHAR)')
+        connection.executemany('INSERT INTO matches (id, uid, user_uid) VALUES (?, ?, ?)',
+                               [(1, 1, 100), (2, 1, 100), (3, 1, 200)])
+        connection.execute("INSERT INTO photos (match_id, link) VALUES (2, 'link')")
+        connection.commit()
+        connection.close()
+
+        db = AppDB(self.path)
+
+        connection = sqlite3.connect(self.path)
+        ids = [row[0] for row in connection.execute('SELECT id FROM matches ORDER BY id')]
+        photos = connection.execute('SELECT count(*) FROM photos').fetchone()[0]
+        connection.close()
+        self.assertEqual(ids, [1, 3], 'Duplicate matches are dropped')
+        self.assertEqual(photos, 0)
+
+        with db_session(db.factory) as session:
+            db.upsert_matches([make_match(1, score=5)], 100, session)
+            self.assertEqual(db.get_match(1, 100, session).total_score, 5,
+                             'Upsert works against the migrated table')
+
+    def test_upsert_matches(self):
+        db = AppDB(self.path)
+
+        with db_session(db.factory) as session:
+            written = db.upsert_matches([make_match(1), make_match(2)], 100, session)
+
+        with db_session(db.factory) as session:
+            db.get_match(1, 100, session).seen = True
+
+        updated = make_match(1, score=7)
+        updated.photos = [{'link': 'https://photo/new'}]
+        no_photos = make_match(2, score=3)
+        no_photos.photos = []
+
+        with db_session(db.factory) as session:
+            db.upsert_matches([updated, no_photos, make_match(3)], 100, session)
+            db.update_scores([make_match(3, score=9)], 100, session)
+
+        with db_session(db.factory) as session:
+            first, second, third = (db.get_match(uid, 100, session) for uid in (1, 2, 3))
+            rows = session.query(DBMatch).count()
+
+            self.assertEqual(written, 2)
+            self.assertEqual(rows, 3, 'Matches are unique per user')
+            self.assertTrue(first.seen, 'Seen flag survives an update')
+            self.assertEqual(first.total_score, 7)
+            self.assertEqual([photo.link for photo in first.photos], ['https://photo/new'])
+            self.assertEqual([photo.link for photo in second.photos], ['https://photo/2'],
+                             'Stored photos are kept when none come with the match')
+            self.assertEqual(third.total_score, 9)
+
+    def test_fresh_matches(self):
+        db = AppDB(self.path)
+
+        with db_session(db.factory) as session:
+            db.upsert_matches([make_match(1), make_match(2)], 100, session)
+
+        with db_session(db.factory) as session:
+            db.get_match(2, 100, session).fetched_at = datetime.now() - timedelta(days=2)
+
+        with db_session(db.factory) as session:
+            fresh = db.get_fresh_matches(100, [1, 2, 3], datetime.now() - timedelta(days=1), 0,
+                                         session)
+            stored = Match.from_database(db.get_match(1, 100, session))
+
+        self.assertEqual(fresh, {1}, 'Only recently fetched matches are fresh')
+        self.assertEqual(list(stored.groups), [1, 2, 3], 'Match data is stored for rescoring')
+        self.assertEqual(stored.photos, [{'link': 'https://photo/1'}])
+
+    def test_fresh_groups_hash(self):
+        db = AppDB(self.path)
+        checked = make_match(1)
+        checked.groups_hash = 5
+
+        with db_session(db.factory) as session:
+            db.upsert_matches([checked, make_match(2)], 100, session)
+
+        since = datetime.now() - timedelta(days=1)
+        with db_session(db.factory) as session:
+            self.assertEqual(db.get_fresh_matches(100, [1, 2], since, 5, session), {1, 2})
+            self.assertEqual(db.get_fresh_matches(100, [2], since, 5, session), {2},
+                             'Only the given matches are checked')
+            self.assertEqual(db.get_fresh_matches(100, [1, 2], since, 6, session), {2},
+                             "Groups checked against other user's groups are stale")
+            self.assertEqual(Match.from_database(db.get_match(1, 100, session)).groups_hash, 5)
+
+    def test_lazy_photos(self):
+        db = AppDB(self.path)
+        match = make_match(1)
+        match.photos = []
+
+        with db_session(db.factory) as session:
+            db.upsert_matches([match], 100, session)
+
+        with db_session(db.factory) as session:
+            shown = db.pop_match(100, 10, session)
+            match_id, popped = next(iter(shown.items()))
+            db.add_photos(match_id, [{'link': 'https://photo/1'}], session)
+
+        with db_session(db.factory) as session:
+            db.upsert_matches([match], 100, session)
+
+        with db_session(db.factory) as session:
+            stored = Match.from_database(db.get_match(1, 100, session))
+
+        self.assertEqual(popped['uid'], 1)
+        self.assertEqual(popped['photos'], [], 'Photos are not fetched with the match')
+        self.assertEqual(stored.photos, [{'link': 'https://photo/1'}],
+                         'Refetching a match keeps the photos already shown')
+
+    def test_evict_matches(self):
+        db = AppDB(self.path)
+
+        with db_session(db.factory) as session:
+            db.upsert_matches([make_match(uid, score=uid) for uid in range(10)], 100, session)
+            db.upsert_matches([make_match(1, score=1)], 200, session)
+
+        with db_session(db.factory) as session:
+            db.get_match(0, 100, session).seen = True
+            # Fetched long ago, but not in the latest search
+            db.get_match(6, 100, session).fetched_at = datetime.now() - timedelta(days=40)
+
+        with db_session(db.factory) as session:
+            evicted = db.evict_matches(100, {0, 1, 2, 3, 4, 5}, datetime.now() - timedelta(days=30),
+                                       session)
+
+        with db_session(db.factory) as session:
+            kept = {uid for uid in range(10) if db.get_match(uid, 100, session)}
+            photos = session.query(Photo).count()
+            other_user = db.get_match(1, 200, session)
+
+        self.assertEqual(evicted, 6)
+        self.assertEqual(kept, {0, 7, 8, 9}, 'Seen and recent matches are kept')
+        self.assertIsNotNone(other_user, "Other users' matches are kept")
+        self.assertEqual(photos, 5, 'Photos of evicted matches are deleted')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+import unittest
+
+from vkinder.decoder import Decoder, loads
+
+
+class DecoderTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.decoder = Decoder(prune=True)
+
+    def test_loads(self):
+        self.assertEqual(loads(b'{"response": [1, "\\u0430"]}'), {'response': [1, 'а']})
+
+    def test_prune_users(self):
+        users = [{'id': 1, 'first_name': 'A', 'last_name': 'B', 'is_closed': False,
+                  'track_code': 'xyz', 'can_access_closed': True, 'music': 'rock',
+                  'city': {'id': 1, 'title': 'Moscow'}}]
+        pruned = self.decoder.prune('users.search', {'fields': 'city,music'},
+                                    {'count': 1, 'items': users})
+
+        self.assertEqual(pruned['count'], 1)
+        self.assertEqual(pruned['items'], [{'id': 1, 'first_name': 'A', 'last_name': 'B',
+                                            'is_closed': False, 'music': 'rock',
+                                            'city': {'id': 1, 'title': 'Moscow'}}],
+                         'Only requested and basic fields are kept')
+
+    def test_prune_photos(self):
+        photos = {'count': 1, 'items': [{'id': 1, 'owner_id': 2, 'text': 'long caption',
+                                         'likes': {'count': 5, 'user_likes': 0},
+                                         'sizes': [{'type': 'm', 'url': 'u', 'width': 1}]}]}
+        pruned = self.decoder.prune('photos.get', {}, photos)['items'][0]
+
+        self.assertNotIn('text', pruned)
+        self.assertEqual(pruned['sizes'], [{'type': 'm', 'url': 'u'}])
+        self.assertEqual(pruned['likes']['count'], 5)
+
+    def test_prune_mutual(self):
+        mutual = [{'id': 1, 'common_friends': [10, 11, 12], 'common_count': 3}]
+
+        self.assertEqual(self.decoder.prune('friends.getMutual', {}, mutual),
+                         [{'id': 1, 'common_count': 3}])
+
+    def test_untouched(self):
+        response = {'count': 1, 'items': [{'id': 1, 'name': 'Moscow'}]}
+
+        self.assertIs(self.decoder.prune('database.getCities', {}, response), response)
+        self.assertIs(Decoder(prune=False).prune('users.get', {}, [{'id': 1}])[0]['id'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
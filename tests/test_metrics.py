@@ -0,0 +1,53 @@
+import os
+import tempfile
+import unittest
+
+from vkinder.metrics import Metrics, Histogram
+
+
+class MetricsTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.metrics = Metrics()
+        self.metrics.observe_request('users.get', 0.2, 1024)
+        self.metrics.observe_request('users.get', 3.0, 2048)
+        self.metrics.observe_error('execute', 10)
+        self.metrics.observe_retry('execute')
+        self.metrics.observe_throttle(0.3)
+
+    def test_histogram(self):
+        histogram = Histogram(buckets=(0.1, 1.0, float('inf')))
+        for value in (0.05, 0.5, 0.7, 2.0):
+            histogram.observe(value)
+
+        self.assertEqual(histogram.counts, [1, 3, 4], 'Buckets are cumulative')
+        self.assertEqual(histogram.quantile(0.5), 1.0)
+        self.assertEqual(histogram.quantile(1), 2.0, 'Quantile never exceeds the maximum')
+
+    def test_summary(self):
+        summary = self.metrics.summary()
+
+        self.assertIn('users.get', summary)
+        self.assertIn('Error 10 in execute: 1', summary)
+        self.assertIn('Throttled 1 times', summary)
+
+    def test_prometheus(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'vkinder.prom')
+            self.metrics.write_prometheus(path)
+
+            with open(path) as f:
+                lines = f.read().splitlines()
+
+            self.assertEqual(os.listdir(directory), ['vkinder.prom'], 'No temporary files left')
+
+        self.assertIn('vkinder_api_calls_total{method="users.get"} 2', lines)
+        self.assertIn('vkinder_api_request_seconds_bucket{method="users.get",le="+Inf"} 2', lines)
+        self.assertIn('vkinder_api_request_seconds_bucket{method="users.get",le="0.25"} 1', lines)
+        self.assertIn('vkinder_api_response_bytes_total{method="users.get"} 3072', lines)
+        self.assertIn('vkinder_api_errors_total{method="execute",code="10"} 1', lines)
+        self.assertIn('vkinder_api_retries_total{method="execute"} 1', lines)
+
+
+if __name__ == '__main__':
+    unittest.main()
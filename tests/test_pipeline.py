@@ -0,0 +1,83 @@
+import threading
+import unittest
+
+from vkinder.pipeline import Pipeline
+
+
+class TestPipeline(unittest.TestCase):
+
+    def test_run(self):
+        collected = []
+
+        def double(items):
+            for item in items:
+                yield item * 2
+
+        def odd(items):
+            for item in items:
+                if item % 4:
+                    yield item
+
+        def collect(items):
+            for item in items:
+                collected.append(item)
+                yield item
+
+        pipeline = Pipeline(buffer=2)
+        pipeline.add('double', double).add('odd', odd).add('collect', collect)
+        count = pipeline.run(range(10))
+
+        self.assertEqual(count, 5)
+        self.assertEqual(collected, [2, 6, 10, 14, 18], 'Order is preserved')
+        self.assertEqual([stats.items for stats in pipeline.stats], [10, 5, 5])
+        self.assertIn('double: 10 items', pipeline.report())
+
+    def test_source_stage(self):
+        pipeline = Pipeline()
+        pipeline.add('source', lambda _: iter(range(3)))
+
+        self.assertEqual(pipeline.run(), 3)
+
+    def test_bounded(self):
+        produced = []
+        release = threading.Event()
+
+        def produce(items):
+            for item in items:
+                produced.append(item)
+                yield item
+
+        def consume(items):
+            release.wait(timeout=5)
+            yield from items
+
+        pipeline = Pipeline(buffer=3)
+        pipeline.add('produce', produce).add('consume', consume)
+
+        runner = threading.Thread(target=pipeline.run, args=(range(100),))
+        runner.start()
+        threading.Event().wait(0.3)
+
+        # One item is held by the producer blocked on a full queue
+        self.assertLessEqual(len(produced), 4, 'Producer is held back')
+
+        release.set()
+        runner.join()
+        self.assertEqual(len(produced), 100)
+
+    def test_error(self):
+        def fail(items):
+            for item in items:
+                if item == 50:
+                    raise ValueError('bad item')
+                yield item
+
+        pipeline = Pipeline(buffer=5)
+        pipeline.add('pass', lambda items: iter(items)).add('fail', fail)
+
+        with self.assertRaises(ValueError):
+            pipeline.run(range(1000))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+import unittest
+
+from vkinder.exceptions import NoTokensLeft
+from vkinder.ratelimit import TokenBucket, TokenPool
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class TokenBucketTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.clock = FakeClock()
+        self.bucket = TokenBucket(rate=3, capacity=1,
+                                  clock=self.clock, sleep=self.clock.sleep)
+
+    def test_spacing(self):
+        waits = [self.bucket.acquire() for _ in range(4)]
+
+        self.assertEqual(waits[0], 0, 'First request goes straight away')
+        for wait in waits[1:]:
+            self.assertAlmostEqual(wait, 1 / 3, msg='Requests are spaced out evenly')
+        self.assertAlmostEqual(self.bucket.throttled, 1.0, msg='Throttled time is counted')
+
+    def test_no_wait_after_idle(self):
+        self.bucket.acquire()
+        self.clock.now += 10
+
+        self.assertEqual(self.bucket.acquire(), 0, 'Idle bucket is full again')
+
+    def test_penalize_and_recover(self):
+        self.bucket.penalize()
+
+        self.assertEqual(self.bucket.rate, 1.5, 'Rate is halved after rejection')
+        self.assertEqual(self.bucket.penalties, 1)
+
+        for _ in range(100):
+            self.bucket.reward()
+
+        self.assertEqual(self.bucket.rate, 3, 'Rate never exceeds the documented budget')
+
+
+class TokenPoolTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.pool = TokenPool(['one', 'two', 'three'], rate=3, capacity=1,
+                              sleep=lambda seconds: None)
+
+    def test_spread(self):
+        used = [self.pool.acquire() for _ in range(3)]
+
+        self.assertEqual({token for token, _ in used}, {'one', 'two', 'three'},
+                         'Calls are spread across all tokens')
+        self.assertTrue(all(wait == 0 for _, wait in used), 'No token had to wait')
+
+    def test_penalized_token_is_avoided(self):
+        self.pool.penalize('one')
+        used = {self.pool.acquire()[0] for _ in range(2)}
+
+        self.assertEqual(used, {'two', 'three'}, 'Token with no budget is picked last')
+
+    def test_retire(self):
+        self.assertEqual(self.pool.retire('one'), 2)
+        self.assertEqual(self.pool.retire('two'), 1)
+        self.assertEqual(self.pool.acquire()[0], 'three', 'Retired tokens are not used')
+
+        self.pool.retire('three')
+        with self.assertRaises(NoTokensLeft):
+            self.pool.acquire()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,167 @@
+import unittest
+from unittest.mock import patch, MagicMock
+
+import requests
+
+from vkinder.api import VKApi
+from vkinder.exceptions import InternalServerError, InvalidUserID, HTTPStatusError, \
+    DeadlineExceeded, CircuitOpen, TooManyRequestsPerSecond, NetworkError
+from vkinder.ratelimit import TokenPool
+from vkinder.retry import RetryPolicy, CircuitBreaker
+from vkinder.transport import LocalTransport
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class FlakyVK:
+    """Fails with the given errors first, then answers."""
+
+    def __init__(self, *failures):
+        self.failures = list(failures)
+        self.calls = 0
+
+    def __call__(self, method, params):
+        self.calls += 1
+        if method == 'users.get' and 'user_ids' not in params:
+            return {'response': [{'id': 1, 'first_name': 'Test', 'last_name': 'User'}]}
+        if self.failures:
+            failure = self.failures.pop(0)
+            if isinstance(failure, Exception):
+                raise failure
+            return {'error': {'error_code': failure, 'error_msg': 'Error'}}
+        return {'response': {'count': 0, 'items': []}}
+
+
+class RetryPolicyTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.policy = RetryPolicy(base_delay=1, max_delay=4, codes=[6, 10], statuses=[503])
+
+    def test_backoff(self):
+        for attempt in range(10):
+            delay = self.policy.backoff(attempt)
+            self.assertGreaterEqual(delay, 0)
+            self.assertLessEqual(delay, min(4, 2 ** attempt), 'Delay is capped')
+
+    def test_classification(self):
+        self.assertTrue(self.policy.retryable(InternalServerError('', error={'error_code': 10})))
+        self.assertFalse(self.policy.retryable(InvalidUserID('', error={'error_code': 113})))
+        self.assertTrue(self.policy.retryable(HTTPStatusError('', status=503)))
+        self.assertFalse(self.policy.retryable(HTTPStatusError('', status=404)))
+        self.assertTrue(self.policy.retryable(requests.ConnectionError()))
+        self.assertFalse(self.policy.degrading(TooManyRequestsPerSecond('', error={'error_code': 6})),
+                         'Rate limit errors do not trip the breaker')
+
+    def test_run_deadline(self):
+        clock = FakeClock()
+        policy = RetryPolicy(call_deadline=60, run_deadline=10, clock=clock)
+
+        self.assertEqual(policy.deadline(), 60)
+        policy.start_run()
+        self.assertEqual(policy.deadline(), 10, 'Run deadline comes first')
+
+
+class CircuitBreakerTest(unittest.TestCase):
+
+    def test_states(self):
+        clock = FakeClock()
+        breaker = CircuitBreaker(threshold=2, cooldown=30, clock=clock)
+
+        breaker.failure()
+        breaker.check()
+        breaker.failure()
+        self.assertEqual(breaker.state, 'open')
+        with self.assertRaises(CircuitOpen):
+            breaker.check()
+
+        clock.now += 30
+        breaker.check()
+        with self.assertRaises(CircuitOpen, msg='Only one trial request in half-open state'):
+            breaker.check()
+
+        breaker.failure()
+        self.assertEqual(breaker.state, 'open', 'Failed trial opens the breaker again')
+
+        clock.now += 30
+        breaker.check()
+        breaker.success()
+        self.assertEqual(breaker.state, 'closed')
+
+
+@patch('vkinder.api.clean_screen', MagicMock())
+@patch('builtins.print', MagicMock())
+class VKApiRetryTest(unittest.TestCase):
+
+    def make_api(self, vk, **policy):
+        self.clock = FakeClock()
+        retry = RetryPolicy(clock=self.clock, sleep=self.clock.sleep, **policy)
+        return VKApi('https://api.vk.test/method', '5.103', debug=False,
+                     transport=LocalTransport(vk),
+                     pool=TokenPool(['test_token'], rate=1000),
+                     retry=retry)
+
+    def test_recovers(self):
+        vk = FlakyVK(10, 10, requests.Timeout())
+        api = self.make_api(vk, attempts=5)
+
+        self.assertEqual(api.groups.get(user_id=1)['count'], 0)
+        self.assertEqual(api.metrics.retries['groups.get'], 3)
+
+    def test_gives_up(self):
+        api = self.make_api(FlakyVK(10, 10, 10), attempts=3)
+
+        with self.assertRaises(InternalServerError):
+            api.groups.get(user_id=1)
+
+    def test_network_failure(self):
+        vk = FlakyVK(*[requests.ConnectionError('Connection refused')] * 3)
+        api = self.make_api(vk, attempts=3)
+        calls = vk.calls
+
+        with self.assertRaises(NetworkError) as context:
+            api.groups.get(user_id=1)
+        self.assertIsInstance(context.exception.__cause__, requests.ConnectionError)
+        self.assertEqual(vk.calls - calls, 3, 'Every attempt is made')
+
+    def test_not_retryable(self):
+        vk = FlakyVK(113)
+        api = self.make_api(vk)
+        calls = vk.calls
+
+        with self.assertRaises(InvalidUserID):
+            api.groups.get(user_id=1)
+        self.assertEqual(vk.calls - calls, 1, 'Request is not repeated')
+
+    def test_deadline(self):
+        api = self.make_api(FlakyVK(*[10] * 50), attempts=50,
+                            base_delay=10, max_delay=10, call_deadline=15,
+                            breaker=CircuitBreaker(threshold=100))
+
+        with self.assertRaises(DeadlineExceeded):
+            api.groups.get(user_id=1)
+        self.assertLessEqual(self.clock.now, 15, 'Nothing is retried past the deadline')
+
+    def test_circuit_breaker(self):
+        vk = FlakyVK(*[10] * 3)
+        api = self.make_api(vk, attempts=3, breaker=CircuitBreaker(threshold=3, cooldown=60))
+
+        with self.assertRaises(InternalServerError):
+            api.groups.get(user_id=1)
+
+        calls = vk.calls
+        with self.assertRaises(CircuitOpen):
+            api.groups.get(user_id=1)
+        self.assertEqual(vk.calls, calls, 'Open breaker fails fast')
+
+
+if __name__ == '__main__':
+    unittest.main()
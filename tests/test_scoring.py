@@ -0,0 +1,88 @@
+import copy
+import random
+import unittest
+from unittest.mock import patch
+
+from vkinder import scoring, utils
+from vkinder.scoring import BatchScorer
+from vkinder.types import User, Match, INTERESTS_FACTOR, PERSONAL_FACTOR, GROUPS_FACTOR
+
+TOKENS = ['', 'rock', 'jazz', 'pop', 'matrix', 'чехов', 'пушкин']
+FIELDS = ['music', 'movies', 'tv', 'books', 'games']
+PERSONAL = ['political', 'religion', 'people_main', 'life_main', 'smoking', 'alcohol']
+
+
+def make_interests(rng):
+    return {field: rng.choices(TOKENS, k=rng.randint(0, 4))
+            for field in FIELDS if rng.random() > 0.2}
+
+
+def make_personal(rng):
+    return {field: rng.choice(['', 1, 2, 'x']) for field in PERSONAL if rng.random() > 0.2}
+
+
+def make_matches(rng, amount):
+    return [Match(uid, 'Name', 'Surname', rng.randint(0, 5),
+                  make_interests(rng), make_personal(rng),
+                  rng.choices(range(50), k=rng.randint(0, 30)), [])
+            for uid in range(amount)]
+
+
+class BatchScorerTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        rng = random.Random(1)
+        self.user = User(1, 'Name', 'Surname', 1, 30, 1, make_personal(rng),
+                         make_interests(rng), rng.sample(range(50), 20))
+        self.matches = make_matches(rng, 300)
+
+    def expected(self):
+        matches = copy.deepcopy(self.matches)
+        for match in matches:
+            match.scoring(self.user.compile())
+        return [match.total_score for match in matches]
+
+    @unittest.skipIf(scoring.np is None, 'numpy is not installed')
+    def test_vectorized(self):
+        expected = self.expected()
+        BatchScorer(self.user.compile()).score(self.matches)
+
+        self.assertEqual([match.total_score for match in self.matches], expected)
+        self.assertTrue(any(match.interests_score for match in self.matches))
+        self.assertIsInstance(self.matches[0].total_score, int)
+
+    def test_fallback(self):
+        expected = self.expected()
+
+        with patch.object(scoring, 'np', None):
+            BatchScorer(self.user.compile()).score(self.matches)
+
+        self.assertEqual([match.total_score for match in self.matches], expected)
+
+    def test_model(self):
+        user = self.user
+        model = user.compile()
+
+        for match in self.matches:
+            match.scoring(model)
+            interests = sum(INTERESTS_FACTOR * utils.common(match.interests[field], tokens)
+                            for field, tokens in user.interests.items()
+                            if match.interests.get(field))
+            personal = sum(PERSONAL_FACTOR for field, value in user.personal.items()
+                           if match.personal.get(field) == value)
+            groups = GROUPS_FACTOR * utils.common(match.groups, user.groups)
+
+            self.assertEqual((match.interests_score, match.personal_score, match.groups_score),
+                             (interests, personal, groups))
+
+        for (field, tokens), (_, vocabulary) in zip(model.interests, model.vocabulary):
+            self.assertEqual(set(vocabulary), tokens)
+            self.assertEqual(sorted(vocabulary.values()), list(range(len(tokens))),
+                             'Every token has its own code')
+
+    def test_empty(self):
+        self.assertEqual(BatchScorer(self.user.compile()).score([]), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
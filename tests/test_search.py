@@ -0,0 +1,293 @@
+import asyncio
+import json
+import os
+import re
+import tempfile
+import unittest
+from unittest.mock import patch, MagicMock
+
+from sqlalchemy.exc import SQLAlchemyError
+
+from vkinder import app
+from vkinder.api import VKApi
+from vkinder.app import App, MATCH_FIELDS
+from vkinder.db import db_session
+from vkinder.exceptions import DeadlineExceeded
+from vkinder.ratelimit import TokenPool
+from vkinder.transport import LocalTransport
+from vkinder.types import User, Match
+
+API_URL = 'https://api.vk.test/method'
+VERSION = '5.103'
+
+
+def make_profile(uid):
+    return {'id': uid, 'first_name': f'Name{uid}', 'last_name': 'Surname',
+            'is_closed': False, 'blacklisted': 0, 'blacklisted_by_me': 0,
+            'relation': 1, 'sex': 1, 'bdate': '1.1.1995', 'city': {'id': 1},
+            'music': 'rock, jazz' if uid % 2 else 'pop', 'movies': '', 'interests': '',
+            'tv': '', 'books': '', 'games': '',
+            'personal': {'political': uid % 3, 'religion': 'x', 'people_main': 1,
+                         'life_main': 2, 'smoking': 1, 'alcohol': 1}}
+
+
+class FakeVK:
+    """An in-process VK API with a pool of candidates, runs `execute` scripts too."""
+
+    def __init__(self, size=10, first=1001):
+        self.profiles = {uid: make_profile(uid) for uid in range(first, first + size)}
+        self.groups = {uid: [uid % 5, 10 + uid % 3] for uid in self.profiles}
+        # Private profiles and deleted users don't show up in `friends.getMutual`
+        self.hidden = set()
+        self.calls = []
+
+    def __call__(self, method, params):
+        if method == 'execute':
+            calls = re.findall(r'API\.([\w.]+)\((\{.*?\})\)', params['code'])
+            return {'response': [self.call(method, json.loads(call_params))
+                                 for method, call_params in calls]}
+        return {'response': self.call(method, params)}
+
+    def call(self, method, params):
+        self.calls.append((method, params))
+
+        if method == 'users.search':
+            fields = params['fields'].split(',')
+            items = [{key: value for key, value in profile.items()
+                      if key in ('id', 'first_name', 'last_name', 'is_closed',
+                                 *fields)}
+                     for profile in self.profiles.values()]
+            return {'count': len(items), 'items': items}
+        if method == 'users.get':
+            if 'user_ids' not in params:
+                return [{'id': 1, 'first_name': 'Test', 'last_name': 'User'}]
+            return [self.profiles[int(uid)] for uid in params['user_ids'].split(',')]
+        if method == 'groups.get':
+            items = self.groups[int(params['user_id'])]
+            return {'count': len(items), 'items': items}
+        if method == 'groups.isMember':
+            group_id = int(params['group_id'])
+            return [{'user_id': int(uid), 'member': int(group_id in self.groups[int(uid)])}
+                    for uid in params['user_ids'].split(',')]
+        if method == 'friends.getMutual':
+            return [{'id': int(uid), 'common_friends': [], 'common_count': int(uid) % 4}
+                    for uid in params['target_uids'].split(',')
+                    if int(uid) not in self.hidden]
+        return False
+
+    def methods(self):
+        return [method for method, _ in self.calls]
+
+
+@patch('vkinder.api.clean_screen', MagicMock())
+@patch('builtins.print', MagicMock())
+class SearchTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.dir = tempfile.TemporaryDirectory()
+        self.user = User(1, 'Test', 'User', 2, 27, 1,
+                         {'political': 1, 'religion': 'x', 'people_main': 1,
+                          'life_main': 2, 'smoking': 1, 'alcohol': 1},
+                         {'music': ['rock']}, [1, 2, 10])
+
+    def tearDown(self) -> None:
+        self.dir.cleanup()
+
+    def make_app(self, vk, name='test.db', **kwargs):
+        api = VKApi(API_URL, VERSION, debug=False,
+                    transport=LocalTransport(vk),
+                    pool=TokenPool(['test_token'], rate=1000))
+        vkinder_app = App(api, False, 10, False, False, False,
+                          os.path.join(self.dir.name, name), **kwargs)
+        self.addCleanup(vkinder_app.close)
+
+        vkinder_app.current_user = self.user
+        with db_session(vkinder_app.db.factory) as session:
+            vkinder_app.db.add_user(self.user, session)
+
+        return vkinder_app
+
+    def saved(self, vkinder_app):
+        with db_session(vkinder_app.db.factory) as session:
+            return {match.uid: (match.total_score, match.common_friends)
+                    for match in vkinder_app.db.get_user(self.user.uid, session).matches}
+
+    def test_single_pass(self):
+        vk = FakeVK()
+        two_pass = self.make_app(vk)
+        self.assertEqual(two_pass.spawn_matches(), 10)
+        self.assertIn('users.get', vk.methods(), 'Profiles are fetched separately')
+
+        vk = FakeVK()
+        single_pass = self.make_app(vk, 'single_pass.db', single_pass=True)
+        self.assertEqual(single_pass.spawn_matches(), 10)
+
+        _, search = next(call for call in vk.calls if call[0] == 'users.search')
+        self.assertTrue(set(MATCH_FIELDS.split(',')) <= set(search['fields'].split(',')),
+                        'Match fields are requested along with the search')
+        self.assertEqual(search['fields'].count('relation'), 1)
+        self.assertEqual(vk.methods().count('users.get'), 1,
+                         'Only the token check requests profiles')
+
+        self.assertGreater(len(set(self.saved(single_pass).values())), 1)
+        self.assertEqual(self.saved(single_pass), self.saved(two_pass),
+                         'Both modes save the same matches')
+
+    def test_groups_strategies(self):
+        vk = FakeVK()
+        membership = self.make_app(vk)
+        membership.spawn_matches()
+
+        self.assertEqual(vk.methods().count('groups.isMember'), 3,
+                         "One call per user's group")
+        self.assertNotIn('groups.get', vk.methods())
+
+        vk = FakeVK()
+        groups_lists = self.make_app(vk, 'groups_lists.db')
+        with patch.object(App, '_check_membership', return_value=False):
+            groups_lists.spawn_matches()
+
+        self.assertEqual(vk.methods().count('groups.get'), 10, 'One call per match')
+        self.assertNotIn('groups.isMember', vk.methods())
+
+        self.assertEqual(self.saved(membership), self.saved(groups_lists),
+                         'Both strategies score matches the same')
+
+    def test_membership_batches(self):
+        vk = FakeVK(size=600)
+        self.make_app(vk).spawn_matches()
+
+        checked = [params['user_ids'].count(',') + 1
+                   for method, params in vk.calls if method == 'groups.isMember']
+        self.assertEqual(sorted(checked), [100] * 3 + [500] * 3,
+                         'Membership is checked for up to 500 matches at once')
+
+    def test_groups_change(self):
+        vk = FakeVK()
+        membership = self.make_app(vk, incremental=True)
+        membership.spawn_matches()
+
+        vk.calls.clear()
+        membership.current_user = User(1, 'Test', 'User', 2, 27, 1, self.user.personal,
+                                       self.user.interests, [1, 2, 11])
+        membership.spawn_matches()
+
+        self.assertEqual(vk.methods().count('groups.isMember'), 3,
+                         "Matches are fetched again once the user's groups change")
+
+        expected = self.make_app(FakeVK(), 'expected.db')
+        expected.current_user = membership.current_user
+        expected.spawn_matches()
+        self.assertEqual(self.saved(membership), self.saved(expected))
+
+        vk = FakeVK()
+        groups_lists = self.make_app(vk, 'groups_lists.db', incremental=True)
+        with patch.object(App, '_check_membership', return_value=False):
+            groups_lists.spawn_matches()
+
+            vk.calls.clear()
+            groups_lists.current_user = membership.current_user
+            groups_lists.spawn_matches()
+
+        self.assertNotIn('users.get', vk.methods(), 'Complete groups lists are rescored')
+        self.assertEqual(self.saved(groups_lists), self.saved(expected))
+
+    def test_mutual(self):
+        vk = FakeVK(size=250)
+        vk.hidden = {1001, 1100}
+        vkinder_app = self.make_app(vk)
+
+        mutual = asyncio.run(vkinder_app._get_mutual(list(vk.profiles)))
+
+        batches = [params for method, params in vk.calls if method == 'friends.getMutual']
+        self.assertEqual([batch['target_uids'].count(',') + 1 for batch in batches],
+                         [100, 100, 50], 'Up to 100 matches per call')
+        self.assertTrue(all(batch['source_uid'] == self.user.uid for batch in batches))
+        self.assertEqual(mutual[1003], 3)
+        self.assertNotIn(1001, mutual)
+
+    def test_count_mutual(self):
+        vk = FakeVK()
+        vk.hidden = {1004}
+        vkinder_app = self.make_app(vk)
+
+        stored = Match(1002, 'Name', 'Surname', 7, {}, {}, [], [])
+        fetched = [Match(uid, 'Name', 'Surname', 0, {}, {}, [], [])
+                   for uid in (1003, 1004, 1005)]
+        items = list(vkinder_app._count_mutual([(stored, False)] +
+                                               [(match, True) for match in fetched]))
+
+        self.assertEqual([match.uid for match, _ in items], [1002, 1003, 1004, 1005])
+        self.assertEqual([match.common_friends for match in fetched], [3, 0, 1],
+                         'Private or missing matches have no common friends')
+        self.assertEqual(stored.common_friends, 7, 'Stored matches keep their count')
+        _, params = next(call for call in vk.calls if call[0] == 'friends.getMutual')
+        self.assertEqual(params['target_uids'], '1003,1004,1005')
+
+    def test_prerank(self):
+        vk = FakeVK()
+        vkinder_app = self.make_app(vk, prerank=True)
+
+        with patch.object(app, 'SHORTLIST', 3):
+            self.assertEqual(vkinder_app.spawn_matches(), 3)
+
+        matches = [Match.from_api(profile, vk.groups[uid], [])
+                   for uid, profile in vk.profiles.items()]
+        for match in matches:
+            match.scoring(self.user.compile())
+        expected = [match.uid for match in sorted(matches, key=lambda match: match.total_score,
+                                                  reverse=True)]
+
+        self.assertEqual(set(self.saved(vkinder_app)), set(expected[:3]),
+                         'The best matches are shortlisted')
+        mutual = [params['target_uids'] for method, params in vk.calls
+                  if method == 'friends.getMutual']
+        self.assertEqual(mutual, [','.join(map(str, expected[:3]))],
+                         'Common friends are counted for the shortlist only')
+        self.assertIn('shortlist: 3 of 10 matches', vkinder_app.pipeline_report)
+
+    def test_retain(self):
+        vk = FakeVK()
+        vkinder_app = self.make_app(vk)
+        elsewhere = Match(999, 'Name', 'Surname', 0, {}, {}, [], [])
+        with db_session(vkinder_app.db.factory) as session:
+            vkinder_app.db.upsert_matches([elsewhere], self.user.uid, session)
+
+        vkinder_app.spawn_matches()
+        with patch.object(app, 'KEEP_TOP', 3):
+            self.assertEqual(vkinder_app.spawn_matches(), 3)
+
+        saved = self.saved(vkinder_app)
+        self.assertEqual(len(saved), 4, 'Only the best matches of this search are kept')
+        self.assertIn(999, saved, "Matches that didn't come up in this search are kept")
+        self.assertIn('database: 3 rows', vkinder_app.pipeline_report,
+                      'Only written rows count towards the throughput')
+        self.assertIn('evicted: 7 rows', vkinder_app.pipeline_report)
+
+        vk.profiles.clear()
+        with patch.object(app, 'KEEP_TOP', 3):
+            self.assertEqual(vkinder_app.spawn_matches(), 0)
+        self.assertEqual(self.saved(vkinder_app), saved,
+                         'Nothing is evicted after an empty search')
+
+    def test_metrics_on_failure(self):
+        path = os.path.join(self.dir.name, 'vkinder.prom')
+        vkinder_app = self.make_app(FakeVK(), metrics_path=path)
+
+        with patch.object(App, '_search', side_effect=DeadlineExceeded('No time left')):
+            with self.assertRaises(DeadlineExceeded):
+                vkinder_app.spawn_matches()
+
+        self.assertTrue(os.path.exists(path), 'Metrics are written for failed runs too')
+
+    def test_split_fresh_database_error(self):
+        vkinder_app = self.make_app(FakeVK(), incremental=True)
+
+        with patch.object(vkinder_app.db, 'get_fresh_matches',
+                          side_effect=SQLAlchemyError('database is locked')):
+            self.assertEqual(vkinder_app._split_fresh(['1001', '1002']), (['1001', '1002'], []),
+                             "Matches are fetched if freshness can't be read")
+
+
+if __name__ == '__main__':
+    unittest.main()
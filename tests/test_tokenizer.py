@@ -0,0 +1,33 @@
+import unittest
+
+from vkinder import utils
+from vkinder.tokenizer import Tokenizer
+
+TEXTS = ['', 'Музыка, Кино', 'rock\nJAZZ, (pop) ', '«Мастер и Маргарита»; "Чехов"!',
+         'a/b|c^d', ',,', '  spaces  ,\n\n', 'İstanbul, ǅ', 'музыка, музыка']
+
+
+class TokenizerTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.tokenizer = Tokenizer(cache_size=4)
+
+    def test_same_as_cleanup(self):
+        for text in TEXTS:
+            self.assertEqual(list(self.tokenizer.tokenize(text)), utils.cleanup(text), text)
+
+    def test_tokenize_many(self):
+        self.assertEqual(self.tokenizer.tokenize_many(TEXTS),
+                         [tuple(utils.cleanup(text)) for text in TEXTS])
+
+    def test_cache(self):
+        first = self.tokenizer.tokenize('Музыка, Кино')
+        second = self.tokenizer.tokenize('Музыка, Кино')
+
+        self.assertIs(first, second, 'Results are cached')
+        self.tokenizer.tokenize_many(TEXTS)
+        self.assertEqual(self.tokenizer.cache_info().currsize, 4, 'Cache is bounded')
+
+
+if __name__ == '__main__':
+    unittest.main()
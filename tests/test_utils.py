@@ -1,6 +1,8 @@
 import json
 import os
+import sys
 import unittest
+from datetime import date
 
 import vkinder.utils as utils
 from vkinder import root
@@ -60,6 +62,39 @@ class UtilsTest(unittest.TestCase):
                 self.assertEqual(len(chunk), 2, 'This chunk has 2 ids')
             iteration += 1
 
+    def test_chunked(self):
+        chunks = list(utils.chunked(iter(range(12)), 5))
+
+        self.assertEqual([len(chunk) for chunk in chunks], [5, 5, 2], 'Last chunk is shorter')
+        self.assertEqual(chunks[2], [10, 11])
+        self.assertEqual(list(utils.chunked([], 5)), [], 'Nothing to split')
+
+    def test_split_search(self):
+        criteria = {'sex': 1, 'age_from': 20, 'age_to': 22}
+        today = date(2020, 6, 1)
+
+        years = utils.split_search(criteria, today)
+        self.assertEqual([shard['birth_year'] for shard in years], [1997, 1998, 1999, 2000],
+                         'Split by birth years covering the age range')
+        self.assertEqual(years[0]['sex'], 1, 'Original criteria are kept')
+
+        months = utils.split_search(years[0], today)
+        self.assertEqual(len(months), 12, 'Then by birth months')
+
+        days = utils.split_search(utils.split_search(years[3], today)[1], today)
+        self.assertEqual(len(days), 29, 'Then by birth days of the month')
+        self.assertEqual(utils.split_search(days[0], today), [], 'Day shards are final')
+
+    def test_total_size(self):
+        shared = 'shared' * 100
+        first, second = [shared, 'first'], [shared, 'second']
+
+        self.assertEqual(utils.total_size([first]),
+                         sys.getsizeof(first) + sys.getsizeof(shared) + sys.getsizeof('first'))
+        self.assertEqual(utils.total_size([first, second]),
+                         utils.total_size([first]) + sys.getsizeof(second) +
+                         sys.getsizeof('second'), 'Shared objects are counted once')
+
     def test_verify_bday(self):
         correct_bdate = '1.1.2000'
         correct_bdate2 = '05.08.1995'
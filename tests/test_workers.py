@@ -0,0 +1,52 @@
+import random
+import time
+import unittest
+
+from vkinder.types import User, Match
+from vkinder.workers import WorkerPool
+
+
+def make_profile(rng, uid):
+    return {'id': uid, 'first_name': 'Name', 'last_name': 'Surname',
+            'music': ', '.join(rng.choices(['rock', 'jazz', 'pop', 'Рок'], k=3)),
+            'books': 'чехов\npushkin',
+            'personal': {'political': rng.randint(1, 3), 'smoking': rng.randint(1, 3)}}
+
+
+class WorkerPoolTest(unittest.TestCase):
+
+    def test_parse_score(self):
+        rng = random.Random(1)
+        user = User(1, 'Name', 'Surname', 1, 30, 1, {'political': 2, 'smoking': 1},
+                    {'music': ['rock', 'jazz'], 'books': ['чехов']}, list(range(10)))
+        model = user.compile()
+        profiles = [make_profile(rng, uid) for uid in range(50)]
+        groups = [rng.sample(range(20), 5) for _ in profiles]
+
+        serial = [Match.from_api(profile, match_groups, [])
+                  for profile, match_groups in zip(profiles, groups)]
+        for match in serial:
+            match.scoring(model)
+
+        with WorkerPool(3, model) as pool:
+            parsed = pool.parse(profiles, groups)
+            pool.score(parsed)
+
+        self.assertEqual([match.uid for match in parsed], list(range(50)), 'Order is kept')
+        self.assertEqual([match.interests for match in parsed],
+                         [match.interests for match in serial])
+        self.assertEqual([match.total_score for match in parsed],
+                         [match.total_score for match in serial])
+
+    def test_close_cancels(self):
+        pool = WorkerPool(1, User(1, 'Name', 'Surname', 1, 30, 1, {}, {}, []).compile())
+        futures = [pool._submit(time.sleep, 0.5) for _ in range(6)]
+        pool.close()
+
+        self.assertTrue(any(future.cancelled() for future in futures),
+                        'Pending work is cancelled')
+        self.assertFalse(pool.pending)
+
+
+if __name__ == '__main__':
+    unittest.main()
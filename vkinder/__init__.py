@@ -6,6 +6,7 @@ data = os.path.join(os.getcwd(), 'data')
 resources = os.path.join(root, 'resources')
 tokenpath = os.path.join(resources, 'token.dat')
 dbpath = os.path.join(resources, "vkinder.db")
+cachepath = os.path.join(resources, "cache.db")
 
 config = configparser.ConfigParser()
 config.read_file(open(os.path.join(resources, 'config.ini')))
@@ -1,31 +1,43 @@
+import asyncio
 import logging
 import os
 import sys
 import pickle
 import re
+import time
 from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from getpass import getpass
-from time import sleep
 
 import mechanize
-import requests
 # noinspection PyPackageRequirements
 from oauthlib.oauth2 import MobileApplicationClient
 from requests_oauthlib import OAuth2Session
 from oauthlib.oauth2 import MismatchingStateError
 
 from vkinder.exceptions import APIError, \
-    InternalServerError, TooManyRequestsPerSecond, UserUnavailable, InvalidUserID
+    InternalServerError, TooManyRequestsPerSecond, UserUnavailable, InvalidUserID, \
+    AuthorizationFailed, RateLimitReached, HTTPStatusError, DeadlineExceeded, NetworkError
 from . import config, root, tokenpath, Y, END, G, R
+from .batch import Coalescer, AsyncCoalescer
+from .decoder import Decoder
+from .metrics import Metrics
+from .ratelimit import TokenPool
+from .retry import RetryPolicy, NETWORK_ERRORS
+from .transport import SessionTransport
 from .utils import clean_screen
 
 CLIENT_ID = config.get('App Settings', 'ClientID',
                        fallback=os.environ.get('CLIENT_ID'))
 AUTHORIZE_URL = config.get('VK API', 'AuthorizeUrl')
 REDIRECT_URI = config.get('VK API', 'RedirectUrl')
+CONCURRENCY = config.getint('VK API', 'Concurrency')
 
 UsersMethods = namedtuple('Users', 'get search')
 GroupsMethods = namedtuple('Groups', 'get')
+PhotosMethods = namedtuple('Photos', 'get')
+FriendsMethods = namedtuple('Friends', 'getmutual')
 OtherMethods = namedtuple('Others', 'getcities execute')
 
 logger = logging.getLogger(__name__)
@@ -59,19 +71,27 @@ def check_profile(usergetmethod):
 
 class VKApi:
 
-    def __init__(self, api_url, api_version, debug):
+    def __init__(self, api_url, api_version, debug, tokens=None, transport=None,
+                 pool=None, cache=None, metrics=None, decoder=None, retry=None):
         self.url = api_url
         self.v = api_version
-        self.token = self.authorize()
-        self.auth = {'v': self.v, 'access_token': self.token}
+        self.transport = transport or SessionTransport()
+        self.pool = pool or TokenPool(tokens or [self.authorize()])
+        self.cache = cache
+        self.metrics = metrics or Metrics()
+        self.decoder = decoder or Decoder()
+        self.retry = retry or RetryPolicy()
         self.users = UsersMethods(get=self._users_get, search=self._users_search)
         self.groups = GroupsMethods(get=self._groups_get)
+        self.photos = PhotosMethods(get=self._photos_get)
+        self.friends = FriendsMethods(getmutual=self._friends_get_mutual)
         self.other = OtherMethods(getcities=self._get_cities, execute=self._execute)
 
         if debug:
             fileh = logging.FileHandler(os.path.join(root, 'api.log'))
             fileh.setFormatter(formatter)
-            logger.addHandler(fileh)
+            # Package logger, so calls failed inside `execute` are logged there too
+            logging.getLogger(__package__).addHandler(fileh)
 
         self._test_request()
 
@@ -97,6 +117,23 @@ class VKApi:
 
         return token
 
+    @property
+    def throttled(self):
+        """Total time requests were held back by the rate limiter, in seconds"""
+        return self.pool.throttled
+
+    def coalesce(self, limit=None):
+        """
+        Creates a :class:`vkinder.batch.Coalescer` to queue independent calls
+        and send them in `execute` batches.
+        """
+        return Coalescer(self) if limit is None else Coalescer(self, limit)
+
+    def close(self):
+        self.transport.close()
+        if self.cache:
+            self.cache.close()
+
     def _users_get(self, **kwargs):
         return self._get_response('/users.get',
                                   request_params=kwargs)
@@ -106,6 +143,9 @@ class VKApi:
                                   request_params=kwargs)
 
     def _execute(self, **kwargs):
+        """
+        :return: Whole `execute` reply: `response` and `execute_errors`
+        """
         return self._get_response('/execute',
                                   request_params=kwargs)
 
@@ -113,64 +153,132 @@ class VKApi:
         return self._get_response('/groups.get',
                                   request_params=kwargs)
 
+    def _photos_get(self, **kwargs):
+        return self._get_response('/photos.get',
+                                  request_params=kwargs)
+
+    def _friends_get_mutual(self, **kwargs):
+        return self._get_response('/friends.getMutual',
+                                  request_params=kwargs)
+
     def _get_cities(self, **kwargs):
         return self._get_response('/database.getCities',
                                   request_params=kwargs)
 
     def _get_response(self, method, request_params):
 
-        params = {**self.auth, **request_params}
+        name = method.lstrip('/')
+        params = {'v': self.v, **request_params}
+
+        if self.cache and (cached := self.cache.get(method, params)) is not None:
+            logger.debug(f'Cache hit: method {method}\nParameters {request_params}\n')
+            self.metrics.observe_cache_hit(name)
+            return cached
 
-        response = None
-        success = False
-        retry = 5
+        deadline = self.retry.deadline()
+        attempt = 0
+
+        while True:
+            self.retry.breaker.check()
+
+            token, waited = self.pool.acquire()
+            if waited:
+                logger.debug(f'Throttled for {waited:.3f}s')
+                self.metrics.observe_throttle(waited)
 
-        while not success:
             try:
                 logger.debug(f'Request started: method {method}\nParameters {request_params}')
-                response = self._send_request(self.url + method, params)
-            except TooManyRequestsPerSecond:
-                logger.debug('Handling TooManyRequestsPerSecond exception')
-                sleep(0.3)
-                continue
-            except InternalServerError:
-                logger.debug('Handling InternalServerError exception, '
-                             f'attempts left {retry}')
-                if retry > 0:
-                    retry -= 1
-                    continue
+                response = self._send_request(self.url + method,
+                                              {**params, 'access_token': token})
+            except (AuthorizationFailed, RateLimitReached) as e:
+                left = self.pool.retire(token)
+                logger.debug(f'Token ...{token[-4:]} retired: {e.msg}, tokens left {left}')
+                if not left:
+                    raise
+            except Exception as e:
+                if self.retry.degrading(e):
+                    self.retry.breaker.failure()
                 else:
+                    self.retry.breaker.success()
+
+                if not self.retry.retryable(e):
+                    raise
+                if isinstance(e, TooManyRequestsPerSecond):
+                    self.pool.penalize(token)
+
+                attempt += 1
+                if attempt >= self.retry.attempts:
+                    logger.debug(f'Giving up on {name} after {attempt} attempts')
+                    if isinstance(e, NETWORK_ERRORS):
+                        raise NetworkError(f'{name} failed after {attempt} attempts: {e}') from e
                     raise
+
+                delay = self.retry.backoff(attempt - 1)
+                if self.retry.expired(deadline, delay):
+                    raise DeadlineExceeded(f'No time left to retry {name}') from e
+
+                logger.debug(f'Handling {type(e).__name__}, '
+                             f'retrying in {delay:.2f}s, attempt {attempt}')
+                self.retry.sleep(delay)
             else:
                 logger.debug(f'Response acquired\n')
-                success = True
+                self.retry.breaker.success()
+                self.pool.reward(token)
+                break
+
+            self.metrics.observe_retry(name)
+
+        if self.cache:
+            self.cache.put(method, params, response)
 
         return response
 
-    @staticmethod
-    def _send_request(url, params):
+    def _send_request(self, url, params):
+        method = url.rsplit('/', 1)[-1]
 
-        response = requests.request('POST', url, data=params, timeout=20)
+        started = time.perf_counter()
+        try:
+            response = self.transport.post(url, params)
+        except Exception as e:
+            self.metrics.observe_error(method, type(e).__name__)
+            raise
+        self.metrics.observe_request(method, time.perf_counter() - started,
+                                     len(response.content))
 
         if response.status_code == 200:
-            json_response = response.json()
+            json_response = self.decoder.decode(response.content)
 
             if error := json_response.get('error'):
-                if error['error_code'] == 6:
+                self.metrics.observe_error(method, error['error_code'])
+                if error['error_code'] == 5:
+                    raise AuthorizationFailed('VK API authorization failed',
+                                              error=error)
+                elif error['error_code'] == 6:
                     raise TooManyRequestsPerSecond('VK API allows only 3 requests/sec',
                                                    error=error)
                 elif error['error_code'] == 10:
                     raise InternalServerError('VK API internal server error',
                                               error=error)
+                elif error['error_code'] == 29:
+                    raise RateLimitReached('VK API rate limit reached',
+                                           error=error)
                 elif error['error_code'] == 113:
                     raise InvalidUserID("User doesn't exist", error=error)
                 else:
                     logger.debug(f'VK API Error: {error}')
                     raise APIError('VK API error', error=error)
 
-            return json_response['response']
+            if method == 'execute':
+                # Calls failed inside `execute` don't fail the whole request,
+                # they are listed apart and handled by the coalescer
+                return {'response': json_response['response'],
+                        'execute_errors': json_response.get('execute_errors', [])}
+
+            return self.decoder.prune(method, params, json_response['response'])
         else:
-            response.raise_for_status()
+            self.metrics.observe_error(method, f'http_{response.status_code}')
+            raise HTTPStatusError(f'VK API responded with HTTP {response.status_code}',
+                                  status=response.status_code)
 
     def _get_token(self, discard_token):
         """
@@ -248,3 +356,70 @@ class VKApi:
         clean_screen()
 
         print(f"{G}Authorized as: {owner_name} {owner_surname}{END}")
+
+
+class AsyncVKApi:
+    """
+    Coroutine flavour of :class:`VKApi` with the same method surface.
+
+    Requests are made by the wrapped client in a small thread pool, so they
+    share its connection pool and rate limiter: up to `concurrency` requests
+    may be in flight at once, but they are never sent faster than
+    the rate limit allows.
+    """
+
+    def __init__(self, api, concurrency=CONCURRENCY):
+        self.api = api
+        self.v = api.v
+        self.cache = api.cache
+        self.decoder = api.decoder
+        self.metrics = api.metrics
+        self.retry = api.retry
+        self.users = UsersMethods(get=self._users_get, search=self._users_search)
+        self.groups = GroupsMethods(get=self._groups_get)
+        self.photos = PhotosMethods(get=self._photos_get)
+        self.friends = FriendsMethods(getmutual=self._friends_get_mutual)
+        self.other = OtherMethods(getcities=self._get_cities, execute=self._execute)
+
+        self._executor = ThreadPoolExecutor(max_workers=concurrency,
+                                            thread_name_prefix='vkapi')
+
+    def coalesce(self, limit=None):
+        return AsyncCoalescer(self) if limit is None else AsyncCoalescer(self, limit)
+
+    def close(self):
+        self._executor.shutdown()
+
+    async def _users_get(self, **kwargs):
+        return await self._get_response('/users.get',
+                                        request_params=kwargs)
+
+    async def _users_search(self, **kwargs):
+        return await self._get_response('/users.search',
+                                        request_params=kwargs)
+
+    async def _execute(self, **kwargs):
+        return await self._get_response('/execute',
+                                        request_params=kwargs)
+
+    async def _groups_get(self, **kwargs):
+        return await self._get_response('/groups.get',
+                                        request_params=kwargs)
+
+    async def _photos_get(self, **kwargs):
+        return await self._get_response('/photos.get',
+                                        request_params=kwargs)
+
+    async def _friends_get_mutual(self, **kwargs):
+        return await self._get_response('/friends.getMutual',
+                                        request_params=kwargs)
+
+    async def _get_cities(self, **kwargs):
+        return await self._get_response('/database.getCities',
+                                        request_params=kwargs)
+
+    async def _get_response(self, method, request_params):
+        loop = asyncio.get_running_loop()
+        request = partial(self.api._get_response, method, request_params)
+
+        return await loop.run_in_executor(self._executor, request)
@@ -1,32 +1,94 @@
+import asyncio
+import heapq
 import json
+import math
 import os
 import sys
-from time import sleep
+import time
+from datetime import datetime, timedelta
 
 import vkinder.utils as utils
 from . import config
-from . import resources, data, G, END, dbpath
-from .api import VKApi, check_profile
+from . import data, G, END, dbpath
+from .api import VKApi, AsyncVKApi, check_profile
+from .cache import ResponseCache
+from .ratelimit import TokenPool
+from .transport import SessionTransport, RecordingTransport, ReplayTransport
 from .db import AppDB, db_session
+from .pipeline import Pipeline, StageStats
+from .scoring import BatchScorer
 from .exceptions import UserUnavailable, InvalidUserID
 from .types import User, Match
+from .workers import WorkerPool
 
 API_URL = config.get('VK API', 'APIUrl')
 VERSION = config.get('VK API', 'Version')
+SHARDS_PER_EXECUTE = config.getint('Search', 'ShardsPerExecute')
+REFRESH_TTL = config.getint('Search', 'RefreshTTL')
+FETCH_CHUNK = config.getint('Pipeline', 'FetchChunk')
+PERSIST_BATCH = config.getint('Pipeline', 'PersistBatch')
+SCORE_BATCH = config.getint('Pipeline', 'ScoreBatch')
+KEEP_TOP = config.getint('Match Settings', 'KeepTop')
+KEEP_TTL = config.getint('Match Settings', 'KeepTTL')
+SHORTLIST = config.getint('Match Settings', 'ShortlistSize')
+
+# Profile fields needed to build a match
+# Common friends are counted separately, see `App._count_mutual`
+MATCH_FIELDS = ','.join(['bdate', 'city', 'sex',
+                         'games', 'music', 'movies', 'interests',
+                         'tv', 'books', 'personal'])
+
+# VK API limit of user ids checked by one `groups.isMember`
+MEMBERS_PER_CALL = 500
+# VK API limit of target ids of one `friends.getMutual`
+MUTUAL_PER_CALL = 100
+
+# Replayed requests don't need to be rate limited
+REPLAY_RATE = 10 ** 6
 
 
 class App:
 
-    def __init__(self, api, export, output_amount, ignore_city, ignore_age, same_sex, db):
+    def __init__(self, api, export, output_amount, ignore_city, ignore_age, same_sex, db,
+                 stats=False, metrics_path=None, full_search=False, single_pass=False,
+                 incremental=False, prerank=False, workers=0):
         self.api = api
+        self.aio = AsyncVKApi(api)
         self.db = AppDB(db)
         self.export = export
         self.output_amount = output_amount
         self.ignore_city = ignore_city
         self.ignore_age = ignore_age
         self.same_sex = same_sex
+        self.stats = stats
+        self.metrics_path = metrics_path
+        self.full_search = full_search
+        self.single_pass = single_pass
+        self.incremental = incremental
+        self.prerank = prerank
+        self.workers = workers
+        self.worker_pool = None
+        self.dropped = set()
 
         self.current_user = None
+        self.pipeline_report = ''
+        self.prerank_report = ''
+        self.database_report = ''
+        self.memory_report = ''
+
+    @property
+    def current_user(self):
+        return self._current_user
+
+    @current_user.setter
+    def current_user(self, user):
+        """Compiles the match model of every user set as current."""
+        self._current_user = user
+        self.match_model = user.compile() if user else None
+
+    def close(self):
+        self.aio.close()
+        self.api.close()
 
     def set_user(self, id_or_screenname):
         try:
@@ -82,26 +144,55 @@ class App:
         if not self.current_user:
             return False
 
-        profiles, groups, photos = self._prepare_matches()
+        search_criteria = self.current_user.search_criteria(self.ignore_city,
+                                                            self.ignore_age,
+                                                            self.same_sex)
 
-        bar = utils.progress_bar("Building matches: ")
+        if self.single_pass:
+            # Profiles come along with the search results,
+            # no need to fetch them separately
+            search_criteria = {**search_criteria,
+                               'fields': f"{search_criteria['fields']},{MATCH_FIELDS}"}
+
+        pipeline = Pipeline()
+        pipeline.add('search', lambda _: self._search(search_criteria))
+        pipeline.add('sift', self._sifter)
+        pipeline.add('fetch', self._fetch)
+        if self.prerank:
+            pipeline.add('prerank', self._prerank)
+        pipeline.add('mutual', self._count_mutual)
+        pipeline.add('score', self._score)
+        if KEEP_TOP:
+            pipeline.add('retain', self._retain)
+        pipeline.add('persist', self._persist)
+
+        if self.workers:
+            self.worker_pool = WorkerPool(self.workers, self.match_model)
+
+        self.prerank_report = ''
+        self.database_report = ''
+        self.memory_report = ''
+        self.dropped = set()
+
+        self.api.retry.start_run()
+        try:
+            found = pipeline.run()
+        finally:
+            self.api.retry.end_run()
+            self.pipeline_report = '\n'.join(filter(None, [pipeline.report(),
+                                                        self.prerank_report,
+                                                        self.database_report,
+                                                        self.memory_report]))
 
-        for match_info, match_groups, match_photos in \
-                bar(zip(profiles, groups, photos),
-                    max_value=len(profiles)):
-            top3_photos = self._get_top3_photos(match_photos)
-            match_object = Match.from_api(match_info, match_groups, top3_photos)
-            match_object.scoring(self.current_user)
+            if self.worker_pool:
+                self.worker_pool.close()
+                self.worker_pool = None
 
-            with db_session(self.db.factory) as session:
-                if match_in_db := self.db.get_match(match_object.uid,
-                                                    self.current_user.uid,
-                                                    session):
-                    self.db.update_match(match_in_db, match_object, session)
-                else:
-                    self.db.add_match(match_object, self.current_user.uid, session)
+            # Failed runs are the ones worth exporting the most
+            if self.metrics_path:
+                self.api.metrics.write_prometheus(self.metrics_path)
 
-        return len(profiles)
+        return found
 
     def list_users(self):
         with db_session(self.db.factory) as session:
@@ -120,6 +211,8 @@ class App:
             else:
                 return False
 
+        self._attach_photos(next_matches)
+
         if self.export:
             path = os.path.join(data, f'{user_id}_matches.json')
             with open(path, 'w', encoding='utf8') as f:
@@ -143,35 +236,302 @@ class App:
         user_groups = self.api.groups.get(user_id=user_id)
         return user_groups['items']
 
-    def _prepare_matches(self):
-        search_criteria = self.current_user.search_criteria(self.ignore_city,
-                                                            self.ignore_age,
-                                                            self.same_sex)
-        profiles, groups, photos = self._find_matches(search_criteria)
+    def _search(self, search_criteria):
+        """
+        Pipeline source, yields possible matches.
+
+        :param search_criteria: Dictionary of `users.search` parameters.
+        """
+        if self.full_search:
+            yield from self._sharded_search(search_criteria)
+        else:
+            yield from self.api.users.search(**search_criteria)['items']
+
+    def _fetch(self, matches):
+        """
+        Pipeline stage, fetches matches profiles along with their groups
+        chunk by chunk. Chunks are `MEMBERS_PER_CALL` matches large when
+        checking the current user groups membership pays off
+        (see :meth:`_get_groups`), `FetchChunk` otherwise.
+
+        In the incremental mode matches fetched recently enough are
+        loaded from the database instead. Profiles are parsed in worker
+        processes if there are any.
+
+        :param matches: Iterator of VK `User` objects.
+        :return: Yields tuples (`Match` object, whether it was fetched from the API).
+        """
+        chunk_size = MEMBERS_PER_CALL if self._check_membership(MEMBERS_PER_CALL) \
+            else FETCH_CHUNK
+
+        for chunk in utils.chunked(matches, chunk_size):
+            matches_ids = [str(match['id']) for match in chunk]
+
+            if self.incremental:
+                matches_ids, fresh = self._split_fresh(matches_ids)
+                for match_object in self._load_matches(fresh):
+                    yield match_object, False
+
+            if not matches_ids:
+                continue
+
+            membership = self._check_membership(len(matches_ids))
+
+            if self.single_pass:
+                fetched = set(matches_ids)
+                profiles = [match for match in chunk if str(match['id']) in fetched]
+                groups = asyncio.run(self._get_groups(matches_ids, membership))
+            else:
+                profiles, groups = asyncio.run(
+                    self._fetch_profiles(matches_ids, MATCH_FIELDS, membership))
+
+            # Photos are fetched only for the matches being shown,
+            # see `next_matches`
+            if self.worker_pool:
+                parsed = self.worker_pool.parse(profiles, groups)
+            else:
+                parsed = [Match.from_api(match_info, match_groups, [])
+                          for match_info, match_groups in zip(profiles, groups)]
+
+            for match_object in parsed:
+                if membership:
+                    match_object.groups_hash = self.match_model.groups_hash
+                yield match_object, True
+
+    def _count_mutual(self, matches):
+        """
+        Pipeline stage, counts common friends of the current user and
+        the fetched matches, chunk by chunk.
+
+        :param matches: Iterator of tuples (`Match` object, whether it was fetched).
+        """
+        for chunk in utils.chunked(matches, FETCH_CHUNK):
+            fetched = [match_object for match_object, is_fetched in chunk if is_fetched]
+
+            if fetched:
+                mutual = asyncio.run(self._get_mutual([match_object.uid
+                                                       for match_object in fetched]))
+                for match_object in fetched:
+                    match_object.common_friends = mutual.get(match_object.uid, 0)
+
+            yield from chunk
+
+    def _prerank(self, matches):
+        """
+        Pipeline stage, scores matches by their groups, interests and
+        personal fields a batch at a time and passes on only the shortlist
+        of `ShortlistSize` best ones, the best first. Common friends are
+        then counted for the shortlist only. The rest are neither counted
+        nor saved, how many is added to the pipeline report.
+
+        :param matches: Iterator of tuples (`Match` object, whether it was fetched).
+        """
+        scorer = self.worker_pool or BatchScorer(self.match_model)
+        total = 0
+
+        def scored():
+            nonlocal total
+            for batch in utils.chunked(matches, SCORE_BATCH):
+                scorer.score([match_object for match_object, _ in batch])
+                total += len(batch)
+                yield from batch
+
+        # Common friends of the fetched matches aren't counted yet,
+        # so they're left out of the score of every match
+        shortlist = heapq.nlargest(SHORTLIST, scored(),
+                                   key=lambda item: item[0].total_score - item[0].friends_score)
+
+        self.prerank_report = f'shortlist: {len(shortlist)} of {total} matches'
+
+        yield from shortlist
+
+    def _score(self, matches):
+        """
+        Pipeline stage, scores matches against the current user
+        a batch at a time (see :mod:`vkinder.scoring`), in worker
+        processes if there are any (see :mod:`vkinder.workers`).
+
+        With stats on, the memory held by the first scored batch is
+        measured and added to the pipeline report. One batch is a fair
+        sample and keeps the cost of measuring small.
+
+        :param matches: Iterator of tuples (`Match` object, whether it was fetched).
+        """
+        scorer = self.worker_pool or BatchScorer(self.match_model)
+        measure = self.stats
+
+        for batch in utils.chunked(matches, SCORE_BATCH):
+            match_objects = [match_object for match_object, _ in batch]
+            scorer.score(match_objects)
+            if measure:
+                size = utils.total_size(match_objects)
+                self.memory_report = f'match memory: {size / len(batch) / 1024:.1f} KiB ' \
+                                     f'per match over {len(batch)} matches'
+                measure = False
+            yield from batch
+
+    def _retain(self, matches):
+        """
+        Pipeline stage, keeps the top `KeepTop` matches and passes them
+        on, the best first, once every match is scored. Uids of the matches
+        left out are kept for eviction (see :meth:`_persist`).
+
+        :param matches: Iterator of tuples (`Match` object, whether it was fetched).
+        """
+        appeared = set()
+
+        def scored():
+            for item in matches:
+                appeared.add(item[0].uid)
+                yield item
+
+        best = heapq.nlargest(KEEP_TOP, scored(), key=lambda item: item[0].total_score)
+        self.dropped = appeared - {match_object.uid for match_object, _ in best}
+
+        yield from best
+
+    def _persist(self, matches):
+        """
+        Pipeline stage, saves matches to the database in one transaction,
+        upserting `PersistBatch` matches per statement. Matches loaded
+        from the database only get their score updated. Finally the
+        user's unseen matches that came up in this search but didn't make
+        the top `KeepTop`, and the ones fetched longer than `KeepTTL` ago,
+        are evicted. Nothing is evicted after a search that found nothing.
 
-        return profiles, groups, photos
+        Database throughput of the written rows and the evicted ones
+        is added to the pipeline report.
 
-    def _find_matches(self, search_criteria):
-        rough_matches = self.api.users.search(**search_criteria)['items']
-        fine_matches = self._sifter(rough_matches)
+        :param matches: Iterator of tuples (`Match` object, whether it was fetched).
+        """
+        user_uid = self.current_user.uid
+        stats = StageStats('database', unit='rows')
+        evicted = StageStats('evicted', unit='rows')
+
+        with db_session(self.db.factory) as session:
+            for batch in utils.chunked(matches, PERSIST_BATCH):
+                started = time.perf_counter()
+                stats.items += self.db.upsert_matches(
+                    [match_object for match_object, fetched in batch if fetched],
+                    user_uid, session)
+                stats.items += self.db.update_scores(
+                    [match_object for match_object, fetched in batch if not fetched],
+                    user_uid, session)
+                stats.elapsed += time.perf_counter() - started
+
+                yield from batch
+
+            if KEEP_TOP and stats.items:
+                started = time.perf_counter()
+                expired = datetime.now() - timedelta(seconds=KEEP_TTL)
+                evicted.items = self.db.evict_matches(user_uid, self.dropped, expired, session)
+                evicted.elapsed = time.perf_counter() - started
+
+            started = time.perf_counter()
+            session.commit()
+            stats.elapsed += time.perf_counter() - started
+
+        self.database_report = repr(stats)
+        if evicted.items:
+            self.database_report += f'\n{evicted!r}'
+
+    def _split_fresh(self, matches_ids):
+        """
+        Separates candidates fetched recently enough (see `RefreshTTL`)
+        from the new and stale ones. Matches whose groups were checked
+        against other groups than the current user's are stale too.
 
-        fields = ','.join([
-            'bdate', 'city', 'sex', 'common_count'
-                                    'games', 'music', 'movies', 'interests',
-            'tv', 'books', 'personal'
-        ])
+        :param matches_ids: List of matches ids.
+        :return: Tuple (ids to fetch, uids of fresh matches).
+        """
+        fetched_since = datetime.now() - timedelta(seconds=REFRESH_TTL)
+        # Everything is fetched if the database can't be read
+        fresh_uids = set()
+
+        with db_session(self.db.factory) as session:
+            fresh_uids = self.db.get_fresh_matches(self.current_user.uid,
+                                                   [int(match_id) for match_id in matches_ids],
+                                                   fetched_since,
+                                                   self.match_model.groups_hash, session)
 
-        profiles = self.api.users.get(
-            user_ids=','.join(fine_matches),
-            fields=fields)
-        groups, photos = self._get_groups_photos(fine_matches)
+        stale = [match_id for match_id in matches_ids if int(match_id) not in fresh_uids]
+        fresh = [int(match_id) for match_id in matches_ids if int(match_id) in fresh_uids]
 
-        return profiles, groups, photos
+        return stale, fresh
+
+    def _load_matches(self, matches_uids):
+        """
+        Builds matches from the data stored in the database.
+
+        :param matches_uids: List of matches uids.
+        :return: List of `Match` objects.
+        """
+        if not matches_uids:
+            return []
+
+        with db_session(self.db.factory) as session:
+            return [Match.from_database(match_in_db)
+                    for match_in_db in self.db.get_matches(self.current_user.uid,
+                                                           matches_uids, session)]
+
+    async def _fetch_profiles(self, matches_ids, fields, membership):
+        """
+        Fetches matches profiles along with their groups.
+        Profiles are requested while the groups batches are still in flight.
+
+        :param matches_ids: List of matches ids.
+        :param fields: Profile fields to request.
+        :param membership: Whether to check the current user groups membership.
+        :return: Tuple (profiles, matches groups).
+        """
+        profiles = self.aio.users.get(user_ids=','.join(matches_ids),
+                                      fields=fields)
+
+        return await asyncio.gather(profiles,
+                                    self._get_groups(matches_ids, membership))
+
+    def _sharded_search(self, search_criteria):
+        """
+        Collects the full pool of candidates, past the limit of 1000
+        results VK API sets for one `users.search`.
+
+        Every query that hits the limit is split into narrower shards
+        along birth date facets (see :func:`vkinder.utils.split_search`)
+        until each shard fits in. Shards of one level are run in
+        `execute` batches. Candidates are deduplicated by id and yielded
+        as soon as their level is done.
+
+        Profiles without a birth year set can't be sharded, so only
+        those returned by the initial query make it into the pool.
+
+        :param search_criteria: Dictionary of `users.search` parameters.
+        :return: Yields VK `User` objects.
+        """
+        seen = set()
+        shards = [search_criteria]
+
+        while shards:
+            batch = self.aio.coalesce(limit=SHARDS_PER_EXECUTE)
+            calls = [(shard, batch.add('users.search', **shard)) for shard in shards]
+            asyncio.run(batch.flush())
+
+            shards = []
+            for shard, call in calls:
+                if not call.result:
+                    continue
+
+                for match in call.result['items']:
+                    if match['id'] not in seen:
+                        seen.add(match['id'])
+                        yield match
+
+                if call.result['count'] > len(call.result['items']):
+                    shards.extend(utils.split_search(shard))
 
     @staticmethod
     def _sifter(rough_matches):
         """
-        Loops through the list of possible matches and filters out unneeded ones.
+        Loops through possible matches and filters out unneeded ones.
 
         For every match, checks
         1) that the match doesn't have the current user blacklisted
@@ -179,65 +539,150 @@ class App:
         3) that the match don't any personal relations
         4) that the match's VK profile is not private
 
-        If all these conditions are met, then the function adds a match id to
-        to the final list of matches.
+        If all these conditions are met, then the match is passed on
+        to the next stage.
 
-        :param rough_matches: List of VK `User` objects.
-        :return: List of matches ids.
+        :param rough_matches: Iterator of VK `User` objects.
+        :return: Yields VK `User` objects.
         """
-        bar = utils.progress_bar('Sorting out data: ')
-
-        sifted = []
-
-        for match in bar(rough_matches, max_value=len(rough_matches)):
+        for match in rough_matches:
             if (not match['blacklisted']) and \
                     (not match['blacklisted_by_me']) and \
                     (match.get('relation', 0) not in (2, 3, 4, 7, 8)) and \
                     not match['is_closed']:
-                sifted.append(str(match['id']))
-                sleep(0.010)
+                yield match
 
-        return sifted
+    async def _get_groups(self, matches_ids, membership=False):
+        """
+        Loops through the list of matches ids and gets groups
+        info for every id.
 
-    @staticmethod
-    def _prepare_code(ids):
-        path = os.path.join(resources, 'vkscript.txt')
+        When the current user is in few enough groups, their membership
+        is checked instead (see :meth:`_get_common_groups`), whichever
+        takes fewer calls (see :meth:`_check_membership`).
+
+        Due to a limitation set by the VK API you can't make more than
+        3 API requests per second. To circumvent this limitation
+        the calls are coalesced into batches of the `execute` method
+        (see :mod:`vkinder.batch`), several of which are kept in flight
+        at once.
 
-        with open(path, encoding='utf8') as f:
-            code = f.read()
+        :param matches_ids: List of matches ids.
+        :param membership: Whether to check the current user groups membership.
+        :return: List of matches groups.
+        """
+        if membership:
+            return await self._get_common_groups(matches_ids)
 
-        return code % (ids, len(ids))
+        batch = self.aio.coalesce()
 
-    def _get_groups_photos(self, matches_ids):
+        groups = [batch.add('groups.get', user_id=int(match_id), count=1000)
+                  for match_id in matches_ids]
+
+        await batch.flush()
+
+        return [call.result['items'] if call.result else [] for call in groups]
+
+    def _check_membership(self, matches_count):
         """
-        Loops through the list of matches ids and gets groups
-        and photos info for every id.
+        Compares the cost of both groups strategies: one `groups.get`
+        per match against one `groups.isMember` per group of the current
+        user per `MEMBERS_PER_CALL` matches. Both are coalesced in
+        `execute` batches alike.
+
+        :param matches_count: Amount of matches to get groups for at once.
+        :return: True if checking the current user groups membership takes
+        fewer calls than getting every match's groups list.
+        """
+        calls = len(self.current_user.groups) * math.ceil(matches_count / MEMBERS_PER_CALL)
+        return calls < matches_count
 
-        Due to a limitation set by the VK API you can't make more than
-        3 API requests per second. To circumvent this limitation
-        the `execute` method of the API is used.
+    async def _get_common_groups(self, matches_ids):
+        """
+        Checks every group of the current user for membership of the
+        whole list of matches at once.
 
-        `Execute` method accepts code written in VKScript format
-        and allows that code to make up to 25 requests per one
-        `execute` method execution.
+        Only the groups shared with the current user are known this way,
+        but that's all :meth:`Match.scoring` needs. The matches are marked
+        with the fingerprint of the user's groups, so they're fetched
+        again once the user's groups change (see :meth:`_split_fresh`).
 
         :param matches_ids: List of matches ids.
-        :return: Tuple of dicts (matches groups, matches photos).
+        :return: List of groups every match shares with the current user.
+        """
+        batch = self.aio.coalesce()
+
+        calls = [(group_id, batch.add('groups.isMember', group_id=group_id,
+                                      user_ids=','.join(chunk)))
+                 for group_id in self.current_user.groups
+                 for chunk in utils.next_ids(matches_ids, MEMBERS_PER_CALL)]
+
+        await batch.flush()
+
+        common = {int(match_id): [] for match_id in matches_ids}
+        for group_id, call in calls:
+            for membership in call.result or []:
+                if membership['member']:
+                    common[membership['user_id']].append(group_id)
+
+        return list(common.values())
+
+    async def _get_mutual(self, matches_uids):
+        """
+        Gets the amount of common friends of the current user and every
+        match, `MUTUAL_PER_CALL` matches per `friends.getMutual` call.
+
+        :param matches_uids: List of matches uids.
+        :return: Dictionary {match uid: amount of common friends}.
         """
-        matches_groups = []
-        matches_photos = []
+        batch = self.aio.coalesce()
 
-        bar = utils.progress_bar('Fetching profiles: ')
+        calls = [batch.add('friends.getMutual', source_uid=self.current_user.uid,
+                           target_uids=','.join(map(str, chunk)))
+                 for chunk in utils.next_ids(matches_uids, MUTUAL_PER_CALL)]
 
-        for ids_chunk in bar(utils.next_ids(matches_ids),
-                             max_value=len(matches_ids) / 12):
-            code = self._prepare_code(ids_chunk)
-            result = self.api.other.execute(code=code)
-            groups, photos = result[0], result[1]
-            matches_groups.extend(groups)
-            matches_photos.extend(photos)
+        await batch.flush()
 
-        return matches_groups, matches_photos
+        return {mutual['id']: mutual['common_count']
+                for call in calls for mutual in call.result or []}
+
+    async def _get_photos(self, matches_ids):
+        """
+        Gets profile photos for every match id, coalesced the same way
+        as groups (see :meth:`_get_groups`).
+
+        :param matches_ids: List of matches ids.
+        :return: List of matches photos.
+        """
+        batch = self.aio.coalesce()
+
+        photos = [batch.add('photos.get', owner_id=int(match_id),
+                            album_id=-6, rev=1, extended=1)
+                  for match_id in matches_ids]
+
+        await batch.flush()
+
+        return [call.result['items'] if call.result else [] for call in photos]
+
+    def _attach_photos(self, matches):
+        """
+        Fetches top photos for the matches that don't have them yet
+        and saves them to the database.
+
+        :param matches: Dictionary of matches returned by `pop_match`.
+        """
+        missing = {match_id: match for match_id, match in matches.items()
+                   if not match['photos']}
+        if not missing:
+            return
+
+        photos = asyncio.run(self._get_photos([match['uid'] for match in missing.values()]))
+
+        with db_session(self.db.factory) as session:
+            for (match_id, match), match_photos in zip(missing.items(), photos):
+                top3_photos = self._get_top3_photos(match_photos)
+                self.db.add_photos(match_id, top3_photos, session)
+                match['photos'] = [photo['link'] for photo in top3_photos]
 
     @staticmethod
     def _get_top3_photos(profile_photos):
@@ -265,6 +710,34 @@ def startup(flags):
     ignore_age = flags.get('ignore_age', False)
     same_sex = flags['same_sex']
     debug = flags['debug']
+    stats = flags.get('stats', False)
+    metrics_path = flags.get('metrics')
+    full_search = flags.get('full_search', False)
+    single_pass = flags.get('single_pass', False)
+    incremental = flags.get('incremental', False)
+    prerank = flags.get('prerank', False)
+    workers = flags.get('workers', 0)
+    record = flags.get('record')
+    replay = flags.get('replay')
+    tokens = flags.get('tokens', [])
+    pool = None
+
+    if tokens_file := flags.get('tokens_file'):
+        tokens.extend(utils.read_tokens(tokens_file))
+
+    # Cached responses would never reach a cassette
+    if flags.get('no_cache') or record or replay:
+        cache = None
+    else:
+        cache = ResponseCache()
+
+    if replay:
+        transport = ReplayTransport(replay)
+        pool = TokenPool(['replay'], rate=REPLAY_RATE)
+    elif record:
+        transport = RecordingTransport(SessionTransport(), record)
+    else:
+        transport = SessionTransport()
 
     try:
         os.mkdir(data)
@@ -276,7 +749,11 @@ def startup(flags):
 
     utils.clean_screen()
 
-    api = VKApi(API_URL, VERSION, debug)
+    api = VKApi(API_URL, VERSION, debug, tokens=tokens, transport=transport,
+                pool=pool, cache=cache)
 
     return App(api, export, output_amount,
-               ignore_city, ignore_age, same_sex, dbpath)
+               ignore_city, ignore_age, same_sex, dbpath,
+               stats=stats, metrics_path=metrics_path,
+               full_search=full_search, single_pass=single_pass,
+               incremental=incremental, prerank=prerank, workers=workers)
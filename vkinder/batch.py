@@ -0,0 +1,210 @@
+"""
+Coalescing of independent VK API calls into `execute` batches.
+
+`Execute` method accepts code written in VKScript format
+and allows that code to make up to 25 requests per one
+`execute` method execution. Calls queued in a :class:`Coalescer`
+are compiled into as few of such scripts as possible and
+their results are handed back to each call. Calls that fail inside
+`execute` with a retryable error are sent again in the next batch.
+
+Calls are cached one by one, each with the TTL of its own method,
+so calls answered from the cache are never sent at all.
+"""
+import asyncio
+import json
+import logging
+
+import vkinder.utils as utils
+from .retry import RetryPolicy
+
+# VK API allows up to 25 API calls per one `execute`
+LIMIT = 25
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+
+class Call:
+    """API call queued for execution in a batch."""
+
+    def __init__(self, method, params):
+        self.method = method
+        self.params = params
+        self.result = None
+        self.done = False
+        self.attempts = 0
+
+    def __repr__(self):
+        return f'Call {self.method} {self.params}'
+
+    @property
+    def code(self):
+        params = json.dumps(self.params, ensure_ascii=False)
+        return f'API.{self.method}({params})'
+
+    def resolve(self, result):
+        """
+        Stores the call result. Calls that failed inside `execute`
+        come back as `false` and resolve to None.
+        """
+        self.result = result if result is not False else None
+        self.done = True
+
+
+class Coalescer:
+    """
+    Queues API calls and executes them in `execute` batches.
+
+    Usage::
+
+        with api.coalesce() as batch:
+            groups = batch.add('groups.get', user_id=1, count=1000)
+            cities = batch.add('database.getCities', country_id=1, q='Moscow')
+
+        groups.result, cities.result
+    """
+
+    def __init__(self, api, limit=LIMIT):
+        self.api = api
+        self.limit = limit
+        self.queue = []
+        self.retry = getattr(api, 'retry', None) or RetryPolicy()
+        self.cache = getattr(api, 'cache', None)
+
+    def __len__(self):
+        return len(self.queue)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.flush()
+
+    def add(self, method, **params):
+        """
+        Queues an API call.
+
+        :param method: VK API method name, e.g. `users.get`
+        :param params: Method parameters
+        :return: :class:`Call` which gets its result after the flush,
+            or right away if the result is cached
+        """
+        call = Call(method, params)
+
+        cached = self.cache.get(method, self._cache_params(call)) if self.cache else None
+        if cached is not None:
+            if metrics := getattr(self.api, 'metrics', None):
+                metrics.observe_cache_hit(method)
+            call.resolve(cached)
+        else:
+            self.queue.append(call)
+
+        return call
+
+    def compile(self):
+        """
+        Empties the queue, compiling queued calls into VKScript code.
+
+        :return: List of (code, calls) tuples, one per `execute`
+        """
+        batches = [(self._to_vkscript(calls), calls)
+                   for calls in utils.next_ids(self.queue, self.limit)]
+        self.queue = []
+
+        return batches
+
+    def flush(self):
+        """Executes all queued calls, retrying the ones that failed."""
+        attempt = 0
+        while batches := self.compile():
+            if attempt:
+                self.retry.sleep(self.retry.backoff(attempt - 1))
+
+            for code, calls in batches:
+                self._resolve(calls, self.api.other.execute(code=code))
+            attempt += 1
+
+    def _resolve(self, calls, reply):
+        """
+        Hands the results of an `execute` back to its calls.
+        Calls that failed with a retryable error are queued again.
+
+        :param calls: Calls of the `execute`
+        :param reply: `execute` reply, its `response` and `execute_errors`
+        """
+        # Failed calls come back as `false`, their errors are listed in the same order
+        errors = iter(reply.get('execute_errors') or ())
+        decoder = getattr(self.api, 'decoder', None)
+        metrics = getattr(self.api, 'metrics', None)
+
+        for call, result in zip(calls, reply['response']):
+            if result is False and (error := next(errors, None)):
+                self._failed(call, error, metrics)
+                continue
+            if decoder:
+                result = decoder.prune(call.method, call.params, result)
+            call.resolve(result)
+
+            # Results of an `execute` that had errors may be incomplete
+            if self.cache and call.result is not None and not reply.get('execute_errors'):
+                self.cache.put(call.method, self._cache_params(call), call.result)
+
+    def _failed(self, call, error, metrics):
+        """
+        Records an error of a call and queues the call again if it's worth retrying,
+        otherwise the call resolves to None.
+        """
+        code = error.get('error_code')
+        logger.debug(f'{call} failed in execute: {error}')
+        if metrics:
+            metrics.observe_error(call.method, code)
+
+        call.attempts += 1
+        if code in self.retry.codes and call.attempts < self.retry.attempts:
+            if metrics:
+                metrics.observe_retry(call.method)
+            self.queue.append(call)
+        else:
+            call.resolve(None)
+
+    def _cache_params(self, call):
+        """
+        :return: Parameters the call would be sent with on its own,
+            so it shares the cache entry with a direct request
+        """
+        return {'v': self.api.v, **call.params}
+
+    @staticmethod
+    def _to_vkscript(calls):
+        return 'return [' + ','.join(call.code for call in calls) + '];'
+
+
+class AsyncCoalescer(Coalescer):
+    """
+    :class:`Coalescer` for :class:`vkinder.api.AsyncVKApi`.
+    All the batches of a flush are kept in flight at once.
+    """
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            await self.flush()
+
+    def __enter__(self):
+        raise TypeError('Use "async with" with AsyncCoalescer')
+
+    async def flush(self):
+        attempt = 0
+        while batches := self.compile():
+            if attempt:
+                await asyncio.sleep(self.retry.backoff(attempt - 1))
+
+            replies = await asyncio.gather(*[self.api.other.execute(code=code)
+                                             for code, _ in batches])
+            for (_, calls), reply in zip(batches, replies):
+                self._resolve(calls, reply)
+            attempt += 1
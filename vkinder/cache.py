@@ -0,0 +1,126 @@
+"""
+On-disk cache of VK API responses.
+
+Responses are content-addressed: the key is a hash of the method name
+and its normalized parameters (the access token excluded), so the same
+request made in another run is answered locally without touching
+the API and its rate limit.
+"""
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+import zlib
+
+import vkinder.utils as utils
+from . import config, cachepath
+
+# Method name -> time to live, in seconds.
+# Methods not listed here are never cached.
+TTL = {method: int(ttl) for method, ttl in config['Cache TTL'].items()}
+MAX_SIZE = config.getint('Cache', 'MaxSize') * 2 ** 20
+
+
+class ResponseCache:
+    """
+    SQLite-backed response cache with a TTL per method and
+    a least recently used eviction policy bounded by total size.
+    """
+
+    def __init__(self, path=cachepath, ttl=None, max_size=MAX_SIZE, clock=time.time):
+        self.ttl = {method.lower(): seconds for method, seconds in (ttl or TTL).items()}
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+        self._clock = clock
+        self._lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.db.execute('CREATE TABLE IF NOT EXISTS responses ('
+                        'key TEXT PRIMARY KEY, '
+                        'method TEXT, '
+                        'expires REAL, '
+                        'accessed REAL, '
+                        'size INTEGER, '
+                        'body BLOB)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS responses_accessed '
+                        'ON responses (accessed)')
+        self.size = self.db.execute('SELECT COALESCE(SUM(size), 0) '
+                                    'FROM responses').fetchone()[0]
+
+    @staticmethod
+    def key(method, params):
+        """
+        Builds a cache key from a method name and request parameters.
+        """
+        payload = method.strip('/') + '\n' + utils.normalize_params(params)
+
+        return hashlib.sha256(payload.encode('utf8')).hexdigest()
+
+    def cacheable(self, method):
+        return self.ttl.get(method.strip('/').lower(), 0) > 0
+
+    def get(self, method, params):
+        """
+        Looks up a cached response.
+
+        :return: Response or None if there is no fresh response cached
+        """
+        if not self.cacheable(method):
+            return None
+
+        key = self.key(method, params)
+        now = self._clock()
+
+        with self._lock:
+            row = self.db.execute('SELECT expires, size, body FROM responses '
+                                  'WHERE key = ?', (key,)).fetchone()
+
+            if row is None:
+                self.misses += 1
+                return None
+
+            expires, size, body = row
+            if expires < now:
+                self.db.execute('DELETE FROM responses WHERE key = ?', (key,))
+                self.size -= size
+                self.misses += 1
+                return None
+
+            self.db.execute('UPDATE responses SET accessed = ? WHERE key = ?', (now, key))
+            self.hits += 1
+
+        return json.loads(zlib.decompress(body))
+
+    def put(self, method, params, response):
+        """Stores a response, evicting least recently used ones if the cache is full."""
+        if not self.cacheable(method):
+            return
+
+        key = self.key(method, params)
+        now = self._clock()
+        ttl = self.ttl[method.strip('/').lower()]
+        body = zlib.compress(json.dumps(response, ensure_ascii=False).encode('utf8'))
+
+        with self._lock:
+            old = self.db.execute('SELECT size FROM responses WHERE key = ?', (key,)).fetchone()
+            self.db.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)',
+                            (key, method.strip('/'), now + ttl, now, len(body), body))
+            self.size += len(body) - (old[0] if old else 0)
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            self.db.execute('DELETE FROM responses')
+            self.size = 0
+
+    def close(self):
+        self.db.close()
+
+    def _evict(self):
+        while self.size > self.max_size:
+            key, size = self.db.execute('SELECT key, size FROM responses '
+                                        'ORDER BY accessed LIMIT 1').fetchone()
+            self.db.execute('DELETE FROM responses WHERE key = ?', (key,))
+            self.size -= size
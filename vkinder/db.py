@@ -1,8 +1,11 @@
 import pickle
 from contextlib import contextmanager
+from datetime import datetime
 
-from sqlalchemy import Column, Integer, String, BLOB, Boolean, ForeignKey
-from sqlalchemy import create_engine, desc
+from sqlalchemy import Column, Integer, String, BLOB, Boolean, DateTime, ForeignKey
+from sqlalchemy import UniqueConstraint, bindparam, delete, insert, update
+from sqlalchemy import create_engine, desc, inspect, select, text
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship, sessionmaker
@@ -11,6 +14,9 @@ from . import R, END
 
 Base = declarative_base()
 
+# Matches deleted per statement on eviction
+EVICT_CHUNK = 500
+
 
 @contextmanager
 def db_session(factory):
@@ -50,6 +56,7 @@ class User(Base):
 
 class Match(Base):
     __tablename__ = 'matches'
+    __table_args__ = (UniqueConstraint('uid', 'user_uid', name='uq_matches_uid_user_uid'),)
 
     id = Column(Integer, primary_key=True)
     uid = Column(Integer)
@@ -59,6 +66,12 @@ class Match(Base):
     profile = Column(String(32))
     total_score = Column(Integer)
     seen = Column(Boolean, default=False)
+    common_friends = Column(Integer)
+    interests = Column(BLOB)
+    personal = Column(BLOB)
+    groups = Column(BLOB)
+    groups_hash = Column(Integer)
+    fetched_at = Column(DateTime)
     photos = relationship('Photo', cascade='save-update, merge, delete')
 
     def __repr__(self):
@@ -84,8 +97,38 @@ class AppDB:
         """
         self.db = create_engine(f'sqlite:///{db_url}')
         Base.metadata.create_all(self.db)
+        self._migrate()
         self.factory = sessionmaker(bind=self.db)
 
+    def _migrate(self):
+        """
+        Adds columns and constraints that were introduced after the database
+        file was created.
+        """
+        inspector = inspect(self.db)
+
+        unique = [constraint['column_names'] for constraint in
+                  inspector.get_unique_constraints('matches')]
+        unique += [index['column_names'] for index in inspector.get_indexes('matches')
+                   if index['unique']]
+        if ['uid', 'user_uid'] not in unique:
+            duplicates = 'SELECT id FROM matches WHERE id NOT IN ' \
+                         '(SELECT MIN(id) FROM matches GROUP BY uid, user_uid)'
+            with self.db.begin() as connection:
+                connection.execute(text(f'DELETE FROM photos WHERE match_id IN ({duplicates})'))
+                connection.execute(text(f'DELETE FROM matches WHERE id IN ({duplicates})'))
+                connection.execute(text('CREATE UNIQUE INDEX uq_matches_uid_user_uid '
+                                        'ON matches (uid, user_uid)'))
+
+        for table in Base.metadata.sorted_tables:
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    column_type = column.type.compile(self.db.dialect)
+                    with self.db.begin() as connection:
+                        connection.execute(text(f'ALTER TABLE {table.name} '
+                                                f'ADD COLUMN {column.name} {column_type}'))
+
     @staticmethod
     def add_user(user_object, session):
         new_user = User(uid=user_object.uid,
@@ -101,32 +144,107 @@ class AppDB:
         session.add(new_user)
 
     @staticmethod
-    def add_match(match_object, user_uid, session):
-        new_match = Match(uid=match_object.uid,
-                          user_uid=user_uid,
-                          name=match_object.name,
-                          surname=match_object.surname,
-                          profile=match_object.profile,
-                          total_score=match_object.total_score)
-
-        session.add(new_match)
-        session.flush()
-
-        photos = [Photo(match_id=new_match.id,
+    def add_photos(match_id, photos, session):
+        photos = [Photo(match_id=match_id,
                         link=photo['link'])
-                  for photo in match_object.photos]
+                  for photo in photos]
 
         session.add_all(photos)
 
     @staticmethod
-    def update_match(match_record, match_object, session):
+    def upsert_matches(match_objects, user_uid, session):
+        """
+        Inserts new matches of the user and updates the stored ones in one
+        statement, then saves photos of the matches that come with them.
+        Stored photos of the rest are kept.
+
+        :return: Amount of written rows
+        """
+        if not match_objects:
+            return 0
+
+        fetched_at = datetime.now()
+        rows = [{'uid': match_object.uid,
+                 'user_uid': user_uid,
+                 'name': match_object.name,
+                 'surname': match_object.surname,
+                 'profile': match_object.profile,
+                 'total_score': match_object.total_score,
+                 'common_friends': match_object.common_friends,
+                 'interests': pickle.dumps(match_object.interests),
+                 'personal': pickle.dumps(match_object.personal),
+                 'groups': pickle.dumps(match_object.groups),
+                 'groups_hash': match_object.groups_hash,
+                 'fetched_at': fetched_at}
+                for match_object in match_objects]
+
+        statement = sqlite_insert(Match.__table__)
+        statement = statement.on_conflict_do_update(
+            index_elements=['uid', 'user_uid'],
+            set_={column: statement.excluded[column] for column in rows[0]
+                  if column not in ('uid', 'user_uid')})
+        session.execute(statement, rows)
+
+        photos = {match_object.uid: match_object.photos
+                  for match_object in match_objects if match_object.photos}
+        if photos:
+            ids = dict(session.execute(select(Match.uid, Match.id).
+                                       where(Match.user_uid == user_uid,
+                                             Match.uid.in_(list(photos)))).all())
+            session.execute(delete(Photo.__table__).
+                            where(Photo.match_id.in_(list(ids.values()))))
+            photo_rows = [{'match_id': ids[match_uid], 'link': photo['link']}
+                          for match_uid, match_photos in photos.items()
+                          for photo in match_photos]
+            session.execute(insert(Photo.__table__), photo_rows)
+
+        return len(rows)
+
+    @staticmethod
+    def update_scores(match_objects, user_uid, session):
+        """
+        Updates scores of stored matches of the user in one statement.
+
+        :return: Amount of written rows
+        """
+        if not match_objects:
+            return 0
 
-        match_record.profile = match_object.profile
-        match_record.total_score = match_object.total_score
+        statement = update(Match.__table__). \
+            where(Match.uid == bindparam('match_uid'), Match.user_uid == user_uid). \
+            values(total_score=bindparam('score'))
+        session.execute(statement, [{'match_uid': match_object.uid,
+                                     'score': match_object.total_score}
+                                    for match_object in match_objects])
 
-        photos = session.query(Photo).filter(Photo.match_id == match_record.id).all()
-        for index, photo in enumerate(photos):
-            photo.link = match_object.photos[index]['link']
+        return len(match_objects)
+
+    @staticmethod
+    def evict_matches(user_uid, match_uids, fetched_before, session):
+        """
+        Deletes the given unseen matches of the user and the ones fetched
+        before the given moment, along with their photos. Seen matches are
+        kept, so they're not shown again.
+
+        :param match_uids: Set of uids of the matches to delete
+        :param fetched_before: Matches fetched earlier are deleted too
+        :return: Amount of deleted matches
+        """
+        stored = session.query(Match.id, Match.uid, Match.fetched_at). \
+            filter(Match.user_uid == user_uid, ~ Match.seen)
+        evicted = [match_id for match_id, match_uid, fetched_at in stored
+                   if match_uid in match_uids or
+                   (fetched_at is not None and fetched_at < fetched_before)]
+
+        # Ids are deleted in chunks to stay within SQLite variables limit
+        for index in range(0, len(evicted), EVICT_CHUNK):
+            chunk = evicted[index:index + EVICT_CHUNK]
+            session.query(Photo).filter(Photo.match_id.in_(chunk)). \
+                delete(synchronize_session=False)
+            session.query(Match).filter(Match.id.in_(chunk)). \
+                delete(synchronize_session=False)
+
+        return len(evicted)
 
     @staticmethod
     def delete_user(user_record, session):
@@ -154,6 +272,28 @@ class AppDB:
         if match:
             return match
 
+    @staticmethod
+    def get_matches(user_uid, match_uids, session):
+        query = session.query(Match)
+        return query.filter(Match.user_uid == user_uid, Match.uid.in_(match_uids)).all()
+
+    @staticmethod
+    def get_fresh_matches(user_uid, match_uids, fetched_since, groups_hash, session):
+        """
+        :param match_uids: List of uids of the matches to check
+        :param groups_hash: Fingerprint of the user's groups, matches whose groups
+        were checked against other groups are stale
+        :return: Set of uids of the given matches fetched after the given moment
+        """
+        query = session.query(Match.uid)
+        filtered = query.filter(Match.user_uid == user_uid,
+                                Match.uid.in_(match_uids),
+                                Match.fetched_at >= fetched_since,
+                                Match.groups_hash.is_(None) |
+                                (Match.groups_hash == groups_hash))
+
+        return {uid for uid, in filtered}
+
     @staticmethod
     def pop_match(user_uid, count, session):
         matches = {}
@@ -164,7 +304,8 @@ class AppDB:
         for match in match_query. \
                 filter(Match.user_uid == user_uid, ~ Match.seen). \
                 order_by(desc(Match.total_score)).limit(count):
-            matches[match.id] = {'name': match.name,
+            matches[match.id] = {'uid': match.uid,
+                                 'name': match.name,
                                  'surname': match.surname,
                                  'profile': match.profile,
                                  'total_score': match.total_score}
@@ -0,0 +1,101 @@
+"""
+Decoding of VK API responses.
+
+Responses are decoded with `orjson` when it is installed
+(`pip install vkinder[fast]`) and with the standard `json` module otherwise.
+
+Optionally responses are pruned right after decoding: user, photo and
+mutual friends objects keep only the fields the application actually uses,
+so large `users.search`, `photos.get` and `friends.getMutual` payloads
+don't linger in memory.
+"""
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+from . import config
+
+PRUNE = config.getboolean('VK API', 'PruneResponses')
+
+# Fields VK returns for every user object regardless of the `fields` parameter
+USER_FIELDS = {'id', 'first_name', 'last_name', 'is_closed', 'deactivated'}
+PHOTO_FIELDS = {'id', 'owner_id', 'likes', 'sizes'}
+PHOTO_SIZE_FIELDS = {'type', 'url'}
+MUTUAL_FIELDS = {'id', 'common_count'}
+
+
+def loads(content):
+    """
+    :param content: JSON document as bytes or string
+    :return: Decoded object
+    """
+    if orjson:
+        return orjson.loads(content)
+    return json.loads(content)
+
+
+def _keep(item, fields):
+    return {key: value for key, value in item.items() if key in fields}
+
+
+def _prune_users(params, users):
+    requested = params.get('fields', '')
+    fields = USER_FIELDS | set(requested.split(',')) if requested else USER_FIELDS
+
+    return [_keep(user, fields) for user in users]
+
+
+def _prune_photos(params, photos):
+    pruned = []
+
+    for photo in photos:
+        photo = _keep(photo, PHOTO_FIELDS)
+        if 'sizes' in photo:
+            photo['sizes'] = [_keep(size, PHOTO_SIZE_FIELDS) for size in photo['sizes']]
+        pruned.append(photo)
+
+    return pruned
+
+
+def _prune_mutual(params, mutual):
+    return [_keep(item, MUTUAL_FIELDS) for item in mutual]
+
+
+# VK API method -> function pruning the list of objects it returns
+PRUNERS = {'users.get': _prune_users,
+           'users.search': _prune_users,
+           'photos.get': _prune_photos,
+           'friends.getMutual': _prune_mutual}
+
+
+class Decoder:
+
+    def __init__(self, prune=PRUNE):
+        self.prune_enabled = prune
+
+    def decode(self, content):
+        return loads(content)
+
+    def prune(self, method, params, response):
+        """
+        Drops unused fields from the objects of a method response.
+
+        :param method: VK API method name, e.g. `users.get`
+        :param params: Request parameters
+        :param response: Decoded `response` part of the reply
+        :return: Pruned response
+        """
+        pruner = PRUNERS.get(method)
+
+        if not self.prune_enabled or not pruner or not response:
+            return response
+
+        if isinstance(response, dict) and 'items' in response:
+            return {**response, 'items': pruner(params, response['items'])}
+        elif isinstance(response, list):
+            return pruner(params, response)
+
+        return response
@@ -27,3 +27,46 @@ class InternalServerError(APIError):
 class TooManyRequestsPerSecond(APIError):
     """Raised if the application makes more than 3 requests per second"""
     pass
+
+
+class AuthorizationFailed(APIError):
+    """Raised if VK API rejected the access token"""
+    pass
+
+
+class RateLimitReached(APIError):
+    """Raised if the access token has run out of its quota for the method"""
+    pass
+
+
+class NoTokensLeft(APIError):
+    """Raised if every access token has been taken out of the rotation"""
+    pass
+
+
+class CassetteError(APIError):
+    """Raised if a replayed request can't be found in the cassette"""
+    pass
+
+
+class HTTPStatusError(APIError):
+    """Raised if VK API responded with an unexpected HTTP status"""
+
+    def __init__(self, message, status, **kwargs):
+        self.status = status
+        super().__init__(message, **kwargs)
+
+
+class NetworkError(APIError):
+    """Raised if VK API can't be reached after all the retries"""
+    pass
+
+
+class DeadlineExceeded(APIError):
+    """Raised if a request can't be retried within its deadline"""
+    pass
+
+
+class CircuitOpen(APIError):
+    """Raised without sending a request while VK API is considered to be down"""
+    pass
@@ -14,6 +14,7 @@ and prints out matches from the database in descending score order.
 import sys
 
 from vkinder import R, G, Y, V, END, B
+from vkinder.exceptions import APIError
 
 
 def run(app):
@@ -80,8 +81,18 @@ def delete_user(app):
 def find_matches(app):
     if app.current_user:
         print(f"\n{G}Please, wait a minute while we're collecting data...{END}\n")
-        found = app.spawn_matches()
+        throttled = app.api.throttled
+        try:
+            found = app.spawn_matches()
+        except APIError as e:
+            print(f'\n{R}Failed to collect data from VK: {e}{END}')
+            return
         print(f'\n{G}{found} matches found and saved.{END}')
+        print(f'{B}{app.pipeline_report}{END}')
+        print(f'{Y}Requests were throttled for '
+              f'{app.api.throttled - throttled:.1f}s to stay within the rate limit.{END}')
+        if app.stats:
+            print(f'\n{B}{app.api.metrics.summary()}{END}')
     else:
         print(f'{R}No current user set.{END}')
 
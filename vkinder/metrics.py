@@ -0,0 +1,172 @@
+"""
+In-process metrics of VK API usage.
+
+:class:`Metrics` is filled in by :class:`vkinder.api.VKApi` and can be
+printed as a summary or written to a file in the Prometheus text
+exposition format (e.g. for the node exporter textfile collector).
+"""
+import os
+import threading
+from collections import Counter, defaultdict
+
+# Request latency histogram buckets, in seconds
+BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float('inf'))
+
+
+class Histogram:
+    """Cumulative histogram with fixed buckets, Prometheus style."""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+        self.max = 0.0
+
+    def observe(self, value):
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+        self.max = max(self.max, value)
+
+    @property
+    def mean(self):
+        return self.sum / self.count if self.count else 0.0
+
+    def quantile(self, q):
+        """Upper bound of the bucket the q-th quantile falls in."""
+        rank = q * self.count
+        for bound, count in zip(self.buckets, self.counts):
+            if count >= rank:
+                return min(bound, self.max)
+        return self.max
+
+
+class Metrics:
+
+    def __init__(self):
+        self.calls = Counter()
+        self.latency = defaultdict(Histogram)
+        self.bytes = Counter()
+        self.errors = Counter()
+        self.retries = Counter()
+        self.cache_hits = Counter()
+        self.throttle_sleeps = 0
+        self.throttle_seconds = 0.0
+
+        self._lock = threading.Lock()
+
+    def observe_request(self, method, seconds, size):
+        with self._lock:
+            self.calls[method] += 1
+            self.latency[method].observe(seconds)
+            self.bytes[method] += size
+
+    def observe_error(self, method, code):
+        with self._lock:
+            self.errors[method, str(code)] += 1
+
+    def observe_retry(self, method):
+        with self._lock:
+            self.retries[method] += 1
+
+    def observe_cache_hit(self, method):
+        with self._lock:
+            self.cache_hits[method] += 1
+
+    def observe_throttle(self, seconds):
+        with self._lock:
+            self.throttle_sleeps += 1
+            self.throttle_seconds += seconds
+
+    def summary(self):
+        """
+        :return: Human readable summary table
+        """
+        lines = [f'{"method":<20}{"calls":>7}{"avg ms":>9}{"p95 ms":>9}'
+                 f'{"max ms":>9}{"KiB":>10}{"errors":>8}{"retries":>9}{"cached":>8}']
+
+        with self._lock:
+            methods = sorted(set(self.calls) | set(self.cache_hits))
+            for method in methods:
+                latency = self.latency[method] if method in self.latency else Histogram()
+                errors = sum(count for (name, _), count in self.errors.items()
+                             if name == method)
+                lines.append(f'{method:<20}{self.calls[method]:>7}'
+                             f'{latency.mean * 1000:>9.0f}'
+                             f'{latency.quantile(0.95) * 1000:>9.0f}'
+                             f'{latency.max * 1000:>9.0f}'
+                             f'{self.bytes[method] / 1024:>10.1f}'
+                             f'{errors:>8}{self.retries[method]:>9}'
+                             f'{self.cache_hits[method]:>8}')
+
+            for (method, code), count in sorted(self.errors.items()):
+                lines.append(f'Error {code} in {method}: {count}')
+
+            lines.append(f'Throttled {self.throttle_sleeps} times '
+                         f'for {self.throttle_seconds:.1f}s in total')
+
+        return '\n'.join(lines)
+
+    def to_prometheus(self):
+        """
+        :return: Metrics in the Prometheus text exposition format
+        """
+        out = []
+
+        def header(name, kind, text):
+            out.append(f'# HELP {name} {text}')
+            out.append(f'# TYPE {name} {kind}')
+
+        with self._lock:
+            header('vkinder_api_calls_total', 'counter', 'VK API requests sent.')
+            for method, count in sorted(self.calls.items()):
+                out.append(f'vkinder_api_calls_total{{method="{method}"}} {count}')
+
+            header('vkinder_api_request_seconds', 'histogram', 'VK API request latency.')
+            for method, histogram in sorted(self.latency.items()):
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    out.append(f'vkinder_api_request_seconds_bucket'
+                               f'{{method="{method}",le="{le}"}} {count}')
+                out.append(f'vkinder_api_request_seconds_sum{{method="{method}"}} '
+                           f'{histogram.sum}')
+                out.append(f'vkinder_api_request_seconds_count{{method="{method}"}} '
+                           f'{histogram.count}')
+
+            header('vkinder_api_response_bytes_total', 'counter', 'Bytes received from VK API.')
+            for method, size in sorted(self.bytes.items()):
+                out.append(f'vkinder_api_response_bytes_total{{method="{method}"}} {size}')
+
+            header('vkinder_api_errors_total', 'counter', 'VK API errors by code.')
+            for (method, code), count in sorted(self.errors.items()):
+                out.append(f'vkinder_api_errors_total{{method="{method}",code="{code}"}} {count}')
+
+            header('vkinder_api_retries_total', 'counter', 'Retried VK API requests.')
+            for method, count in sorted(self.retries.items()):
+                out.append(f'vkinder_api_retries_total{{method="{method}"}} {count}')
+
+            header('vkinder_api_cache_hits_total', 'counter', 'Requests answered from cache.')
+            for method, count in sorted(self.cache_hits.items()):
+                out.append(f'vkinder_api_cache_hits_total{{method="{method}"}} {count}')
+
+            header('vkinder_api_throttle_sleeps_total', 'counter',
+                   'Requests held back by the rate limiter.')
+            out.append(f'vkinder_api_throttle_sleeps_total {self.throttle_sleeps}')
+            header('vkinder_api_throttle_seconds_total', 'counter',
+                   'Time spent waiting for the rate limiter.')
+            out.append(f'vkinder_api_throttle_seconds_total {self.throttle_seconds}')
+
+        return '\n'.join(out) + '\n'
+
+    def write_prometheus(self, path):
+        """
+        Writes metrics to a file. The file is replaced atomically,
+        so a scraper never sees it half-written.
+        """
+        temp = f'{path}.{os.getpid()}.tmp'
+        with open(temp, 'w', encoding='utf8') as f:
+            f.write(self.to_prometheus())
+        os.replace(temp, path)
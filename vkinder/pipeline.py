@@ -0,0 +1,147 @@
+"""
+Streaming staged pipeline.
+
+Every stage is a generator function taking an iterator of items
+from the previous stage and yielding items for the next one.
+Stages run in their own threads connected by bounded queues, so
+a slow stage holds back the ones before it instead of letting
+items pile up in memory, and all stages work at the same time.
+"""
+import queue
+import threading
+import time
+
+from . import config
+
+BUFFER = config.getint('Pipeline', 'Buffer')
+
+# Marks the end of a stream
+_DONE = object()
+
+
+class StageStats:
+    """Throughput of a pipeline stage."""
+
+    def __init__(self, name, unit='items'):
+        self.name = name
+        self.unit = unit
+        self.items = 0
+        self.elapsed = 0.0
+        self.waiting = 0.0
+
+    def __repr__(self):
+        return (f'{self.name}: {self.items} {self.unit} in {self.busy:.2f}s '
+                f'({self.rate:.0f} {self.unit}/s)')
+
+    @property
+    def busy(self):
+        """Time the stage spent working rather than waiting for other stages."""
+        return max(self.elapsed - self.waiting, 0.0)
+
+    @property
+    def rate(self):
+        return self.items / self.busy if self.busy else 0.0
+
+
+class Pipeline:
+
+    def __init__(self, buffer=BUFFER):
+        self.buffer = buffer
+        self.stages = []
+        self.stats = []
+
+        self._stop = threading.Event()
+        self._errors = []
+
+    def add(self, name, stage):
+        """
+        Appends a stage to the pipeline.
+
+        :param name: Stage name used in stats
+        :param stage: Generator function taking an iterator of items
+        :return: The pipeline itself
+        """
+        self.stages.append((name, stage))
+        return self
+
+    def run(self, source=()):
+        """
+        Runs all the stages until the source is exhausted.
+
+        :param source: Iterable feeding the first stage
+        :return: Amount of items that came out of the last stage
+        """
+        self.stats = [StageStats(name) for name, _ in self.stages]
+        queues = [queue.Queue(maxsize=self.buffer) for _ in self.stages]
+        threads = []
+
+        inbox = iter(source)
+        for index, ((name, stage), stats) in enumerate(zip(self.stages, self.stats)):
+            if index:
+                inbox = self._drain(queues[index - 1], stats)
+            thread = threading.Thread(target=self._work, name=f'pipeline-{name}',
+                                      args=(stage, inbox, queues[index], stats), daemon=True)
+            threads.append(thread)
+
+        for thread in threads:
+            thread.start()
+
+        count = sum(1 for _ in self._drain(queues[-1]))
+
+        for thread in threads:
+            thread.join()
+
+        if self._errors:
+            raise self._errors[0]
+
+        return count
+
+    def report(self):
+        return '\n'.join(repr(stats) for stats in self.stats)
+
+    def _work(self, stage, inbox, outbox, stats):
+        started = time.perf_counter()
+        try:
+            for item in stage(inbox):
+                stats.items += 1
+                if not self._put(outbox, item, stats):
+                    return
+        except Exception as e:
+            self._errors.append(e)
+            self._stop.set()
+        finally:
+            stats.elapsed = time.perf_counter() - started
+            self._put(outbox, _DONE)
+
+    def _put(self, outbox, item, stats=None):
+        started = time.perf_counter()
+        try:
+            while not self._stop.is_set() or item is _DONE:
+                try:
+                    outbox.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    if item is _DONE and self._stop.is_set():
+                        return False
+            return False
+        finally:
+            if stats:
+                stats.waiting += time.perf_counter() - started
+
+    def _drain(self, inbox, stats=None):
+        """Iterates over a queue, counting time spent waiting for items as idle."""
+        while True:
+            started = time.perf_counter()
+            try:
+                item = inbox.get(timeout=0.1)
+            except queue.Empty:
+                if self._stop.is_set():
+                    return
+                continue
+            finally:
+                if stats:
+                    stats.waiting += time.perf_counter() - started
+
+            if item is _DONE:
+                return
+            yield item
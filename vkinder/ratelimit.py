@@ -0,0 +1,169 @@
+"""
+Client-side rate limiting for the VK API.
+
+VK allows an access token to make only a few requests per second
+and answers with error 6 to everything above that. Rather than
+firing requests blindly and retrying on the error, requests
+are spaced out beforehand by a token bucket, one per access token.
+"""
+import threading
+import time
+
+from . import config
+from .exceptions import NoTokensLeft
+
+RATE = config.getfloat('VK API', 'RequestsPerSecond')
+BURST = config.getint('VK API', 'Burst')
+
+
+class TokenBucket:
+    """
+    Token bucket shared by all the callers of an API client.
+
+    Every request takes a token out of the bucket, tokens are put back
+    at `rate` per second up to `capacity`. A caller that finds the bucket
+    empty reserves the next token and sleeps until it's available, so
+    concurrent callers queue up instead of racing each other.
+
+    If the API still rejects a request, the rate is halved
+    and then restored little by little with every successful request
+    (additive increase, multiplicative decrease).
+    """
+
+    def __init__(self, rate=RATE, capacity=BURST, min_rate=0.5, recovery=0.05,
+                 clock=time.monotonic, sleep=time.sleep):
+        self.max_rate = rate
+        self.rate = rate
+        self.min_rate = min(min_rate, rate)
+        self.recovery = recovery
+        self.capacity = capacity
+        self.tokens = capacity
+        self.throttled = 0.0
+        self.penalties = 0
+
+        self._clock = clock
+        self._sleep = sleep
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Takes a token out of the bucket, sleeping if there are none.
+
+        :return: Time spent waiting, in seconds
+        """
+        wait = self.reserve()
+
+        if wait:
+            self._sleep(wait)
+
+        return wait
+
+    def reserve(self):
+        """
+        Takes a token out of the bucket without waiting for it.
+
+        :return: Time the caller has to wait before using the token
+        """
+        with self._lock:
+            self._refill()
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+            self.throttled += wait
+
+        return wait
+
+    def available(self):
+        """Amount of tokens in the bucket right now, negative if reserved ahead."""
+        with self._lock:
+            self._refill()
+            return self.tokens
+
+    def penalize(self):
+        """Slows down after the API has rejected a request."""
+        with self._lock:
+            self._refill()
+            self.penalties += 1
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.tokens = min(self.tokens, 0)
+
+    def reward(self):
+        """Speeds back up after a successful request."""
+        with self._lock:
+            if self.rate < self.max_rate:
+                self._refill()
+                self.rate = min(self.max_rate, self.rate + self.recovery)
+
+    def _refill(self):
+        now = self._clock()
+        elapsed = now - self._updated
+        self._updated = now
+        self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+
+
+class TokenPool:
+    """
+    Rotation of several VK access tokens, each with its own :class:`TokenBucket`.
+
+    Every request goes with the token that has the most budget left at the
+    moment, so calls are spread across all the accounts. Tokens rejected
+    by the API for good are retired from the rotation.
+    """
+
+    def __init__(self, tokens, rate=RATE, capacity=BURST, sleep=time.sleep):
+        self.buckets = {token: TokenBucket(rate, capacity) for token in tokens}
+        self.retired = {}
+
+        self._sleep = sleep
+        self._lock = threading.Lock()
+
+        if not self.buckets:
+            raise ValueError('At least one access token is required')
+
+    def __len__(self):
+        return len(self.buckets)
+
+    @property
+    def tokens(self):
+        return list(self.buckets)
+
+    @property
+    def throttled(self):
+        buckets = [*self.buckets.values(), *self.retired.values()]
+        return sum(bucket.throttled for bucket in buckets)
+
+    def acquire(self):
+        """
+        Picks a token and waits for its bucket if needed.
+
+        :return: Tuple (access token, time spent waiting)
+        """
+        with self._lock:
+            if not self.buckets:
+                raise NoTokensLeft('All access tokens have been retired')
+            token = max(self.buckets, key=lambda t: self.buckets[t].available())
+            wait = self.buckets[token].reserve()
+
+        if wait:
+            self._sleep(wait)
+
+        return token, wait
+
+    def penalize(self, token):
+        if bucket := self.buckets.get(token):
+            bucket.penalize()
+
+    def reward(self, token):
+        if bucket := self.buckets.get(token):
+            bucket.reward()
+
+    def retire(self, token):
+        """
+        Takes a token out of the rotation.
+
+        :return: Amount of tokens left in the rotation
+        """
+        with self._lock:
+            if token in self.buckets:
+                self.retired[token] = self.buckets.pop(token)
+            return len(self.buckets)
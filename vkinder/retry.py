@@ -0,0 +1,149 @@
+"""
+Retry policy for VK API requests.
+
+Failed requests are classified by VK error code, HTTP status
+or network error. Retryable ones are repeated with exponential
+backoff and full jitter, as long as neither the attempts limit
+nor the per-call and per-run deadlines are exhausted.
+A circuit breaker makes requests fail fast while VK is degraded.
+"""
+import random
+import threading
+import time
+
+import requests
+
+from . import config
+from .exceptions import APIError, HTTPStatusError, CircuitOpen
+
+ATTEMPTS = config.getint('Retry', 'Attempts')
+BASE_DELAY = config.getfloat('Retry', 'BaseDelay')
+MAX_DELAY = config.getfloat('Retry', 'MaxDelay')
+CALL_DEADLINE = config.getfloat('Retry', 'CallDeadline')
+RUN_DEADLINE = config.getfloat('Retry', 'RunDeadline')
+RETRY_CODES = [int(code) for code in config.get('Retry', 'RetryCodes').split(',')]
+RETRY_STATUSES = [int(code) for code in config.get('Retry', 'RetryStatuses').split(',')]
+BREAKER_THRESHOLD = config.getint('Retry', 'BreakerThreshold')
+BREAKER_COOLDOWN = config.getfloat('Retry', 'BreakerCooldown')
+
+NETWORK_ERRORS = (requests.ConnectionError, requests.Timeout)
+
+
+class CircuitBreaker:
+    """
+    Opens after `threshold` consecutive failures and rejects all requests
+    for `cooldown` seconds. After that a single trial request is let through:
+    if it succeeds the breaker closes, otherwise it opens again.
+    """
+
+    def __init__(self, threshold=BREAKER_THRESHOLD, cooldown=BREAKER_COOLDOWN,
+                 clock=time.monotonic):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.trial = False
+
+        self._clock = clock
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if self._clock() - self.opened_at < self.cooldown:
+            return 'open'
+        return 'half-open'
+
+    def check(self):
+        """Raises :class:`CircuitOpen` if requests are not allowed right now."""
+        with self._lock:
+            state = self.state
+            if state == 'open' or (state == 'half-open' and self.trial):
+                raise CircuitOpen('VK API seems to be down, not sending requests')
+            if state == 'half-open':
+                self.trial = True
+
+    def success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial = False
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.trial or self.failures >= self.threshold:
+                self.opened_at = self._clock()
+                self.trial = False
+
+
+class RetryPolicy:
+
+    def __init__(self, attempts=ATTEMPTS,
+                 base_delay=BASE_DELAY,
+                 max_delay=MAX_DELAY,
+                 call_deadline=CALL_DEADLINE,
+                 run_deadline=RUN_DEADLINE,
+                 codes=RETRY_CODES,
+                 statuses=RETRY_STATUSES,
+                 breaker=None,
+                 clock=time.monotonic,
+                 sleep=time.sleep):
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.call_deadline = call_deadline
+        self.run_deadline = run_deadline
+        self.codes = set(codes)
+        self.statuses = set(statuses)
+        self.breaker = breaker or CircuitBreaker(clock=clock)
+        self.run_started = None
+
+        self._clock = clock
+        self.sleep = sleep
+
+    def start_run(self):
+        """Starts the per-run deadline clock."""
+        self.run_started = self._clock()
+
+    def end_run(self):
+        self.run_started = None
+
+    def deadline(self):
+        """
+        :return: Moment (on the policy clock) after which a new call
+            must not be retried anymore
+        """
+        deadline = self._clock() + self.call_deadline
+        if self.run_started is not None and self.run_deadline:
+            deadline = min(deadline, self.run_started + self.run_deadline)
+        return deadline
+
+    def expired(self, deadline, delay=0.0):
+        return self._clock() + delay > deadline
+
+    def retryable(self, error):
+        if isinstance(error, HTTPStatusError):
+            return error.status in self.statuses
+        if isinstance(error, APIError):
+            return error.code in self.codes
+        return isinstance(error, NETWORK_ERRORS)
+
+    @staticmethod
+    def degrading(error):
+        """Whether the error means VK is in trouble (and counts for the breaker)."""
+        if isinstance(error, HTTPStatusError):
+            return error.status >= 500
+        if isinstance(error, APIError):
+            return error.code in (1, 10)
+        return isinstance(error, NETWORK_ERRORS)
+
+    def backoff(self, attempt):
+        """
+        Exponential backoff with full jitter.
+
+        :param attempt: Number of the failed attempt, starting from 0
+        :return: Delay before the next attempt, in seconds
+        """
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
@@ -0,0 +1,131 @@
+"""
+Batch scoring of matches.
+
+Scores whole batches of matches against one user at once. Every batch
+is flattened into arrays of group ids and interest token codes (taken
+from the vocabulary of a :class:`vkinder.types.MatchModel`) in a CSR-like
+layout: one flat array of values plus the row every value belongs to.
+Each score component is then computed for the entire batch in
+vectorized passes.
+
+Requires `numpy` (`pip install vkinder[fast]`). Without it the scorer
+falls back to :meth:`vkinder.types.Match.scoring` for every match.
+Either way the scores are identical.
+"""
+from itertools import chain, repeat
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from .types import PERSONAL_FACTOR, INTERESTS_FACTOR, FRIENDS_FACTOR, GROUPS_FACTOR
+
+
+def _count_common(rows, codes, width, size):
+    """
+    Counts distinct known values per row.
+
+    :param rows: Array of row numbers of the values
+    :param codes: Array of value codes, -1 for values unknown to the user
+    :param width: Amount of known values
+    :param size: Amount of rows
+    :return: Array of counts, one per row
+    """
+    known = codes >= 0
+    # A row x value bitmap, so duplicates count once
+    hits = np.zeros((size, width), bool)
+    hits[rows[known], codes[known]] = True
+
+    return hits.sum(axis=1)
+
+
+class BatchScorer:
+
+    def __init__(self, model):
+        """
+        :param model: :class:`vkinder.types.MatchModel` to score matches against
+        """
+        self.model = model
+
+        # Sorted ids of the user's groups, a group code is its position
+        self.groups = np.array(sorted(model.groups), np.int64) if np else None
+
+    def score(self, matches):
+        """
+        Sets the score components of every match.
+
+        :param matches: List of :class:`vkinder.types.Match` objects
+        :return: The same list
+        """
+        if np is None:
+            for match in matches:
+                match.scoring(self.model)
+            return matches
+
+        size = len(matches)
+        if not size:
+            return matches
+
+        groups = GROUPS_FACTOR * self._common_groups([match.groups for match in matches])
+
+        interests = np.zeros(size, np.int64)
+        for field, vocabulary in self.model.vocabulary:
+            values = [match.interests.get(field) or () for match in matches]
+            interests += self._common(vocabulary, values)
+        interests *= INTERESTS_FACTOR
+
+        personal = np.zeros(size, np.int64)
+        for field, user_value in self.model.personal:
+            values = np.empty(size, object)
+            values[:] = [match.personal.get(field, None) for match in matches]
+            personal += values == user_value
+        personal *= PERSONAL_FACTOR
+
+        friends = FRIENDS_FACTOR * np.array([match.common_friends for match in matches],
+                                            np.int64)
+
+        for match, interests_score, personal_score, friends_score, groups_score in \
+                zip(matches, interests.tolist(), personal.tolist(),
+                    friends.tolist(), groups.tolist()):
+            match.interests_score = interests_score
+            match.personal_score = personal_score
+            match.friends_score = friends_score
+            match.groups_score = groups_score
+
+        return matches
+
+    def _common_groups(self, groups):
+        """
+        :param groups: List of every match's groups ids, 64 bit integer arrays
+        :return: Array of amounts of distinct groups every match shares with the user
+        """
+        size, width = len(groups), len(self.groups)
+        if not width:
+            return np.zeros(size, np.int64)
+
+        lengths = np.fromiter(map(len, groups), np.int64, size)
+        # Groups arrays are joined as raw buffers, with no per id conversion
+        flat = np.frombuffer(b''.join(groups), np.int64)
+        rows = np.repeat(np.arange(size), lengths)
+
+        # Group ids are numbers, so shared ones are found with a vectorized
+        # membership test and coded by their position in the sorted user groups
+        shared = np.isin(flat, self.groups)
+        codes = np.searchsorted(self.groups, flat[shared])
+
+        return _count_common(rows[shared], codes, width, size)
+
+    @staticmethod
+    def _common(vocabulary, values):
+        """
+        :param vocabulary: Mapping of the user's values to their codes
+        :param values: List of every match's values
+        :return: Array of amounts of distinct values every match shares with the user
+        """
+        lengths = np.fromiter(map(len, values), np.int64, len(values))
+        flat = chain.from_iterable(values)
+        codes = np.fromiter(map(vocabulary.get, flat, repeat(-1)), np.int64, int(lengths.sum()))
+        rows = np.repeat(np.arange(len(values)), lengths)
+
+        return _count_common(rows, codes, len(vocabulary), len(values))
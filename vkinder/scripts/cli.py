@@ -3,26 +3,49 @@ import os.path
 import click
 
 from vkinder import app
-from vkinder import dbpath, tokenpath
+from vkinder import dbpath, tokenpath, cachepath
 from vkinder import menu
 
 
 @click.version_option(prog_name='VKinder')
 @click.option('--debug', '-d', is_flag=True, help='Enable API logging')
+@click.option('--no-cache', is_flag=True, help='Do not use cached API responses')
+@click.option('--record', type=click.Path(dir_okay=False),
+              help='Record all API requests and responses to a cassette file')
+@click.option('--replay', type=click.Path(exists=True, dir_okay=False),
+              help='Replay API responses from a cassette file, without network and auth')
+@click.option('--stats', is_flag=True, help='Print API usage summary after finding matches')
+@click.option('--metrics', type=click.Path(dir_okay=False),
+              help='Write API metrics to this file in Prometheus text format')
+@click.option('--token', '-t', 'tokens', multiple=True,
+              help='VK access token to use instead of the saved one (can be repeated)')
+@click.option('--tokens-file', type=click.Path(exists=True, dir_okay=False),
+              help='File with VK access tokens, one per line')
 @click.option('--export', '-e', is_flag=True,
               help="Export next matches to a JSON file rather than printing to the console")
 @click.option('--output', '-o', default=10, show_default=True,
               help="Amount of matches returned by 'next' menu option")
 @click.group()
 @click.pass_context
-def cli(ctx, output, export, debug):
+def cli(ctx, output, export, metrics, stats, replay, record, tokens_file, tokens,
+        no_cache, debug):
     """
     VKinder: Python coursework by Roman Vlasenko
     """
+    if record and replay:
+        raise click.UsageError('--record and --replay are mutually exclusive')
+
     ctx.ensure_object(dict)
     ctx.obj['output_amount'] = output
     ctx.obj['export'] = export
     ctx.obj['debug'] = debug
+    ctx.obj['no_cache'] = no_cache
+    ctx.obj['stats'] = stats
+    ctx.obj['metrics'] = metrics
+    ctx.obj['record'] = record
+    ctx.obj['replay'] = replay
+    ctx.obj['tokens'] = list(tokens)
+    ctx.obj['tokens_file'] = tokens_file
 
 
 @cli.command()
@@ -31,16 +54,34 @@ def cli(ctx, output, export, debug):
 @click.option('--ignore', '-i',
               type=click.Choice(('city', 'age'), case_sensitive=False), multiple=True,
               help='Ignore city and/or age when searching for matches')
+@click.option('--full-search', '-f', is_flag=True,
+              help='Split the search into shards to get past the limit of 1000 candidates')
+@click.option('--single-pass', is_flag=True,
+              help='Request candidate profiles along with the search results')
+@click.option('--incremental', is_flag=True,
+              help='Refetch only new and stale candidates, rescore the rest from the database')
+@click.option('--prerank', is_flag=True,
+              help='Count common friends and save only a shortlist of the best candidates')
+@click.option('--workers', '-w', type=click.IntRange(min=0), default=0,
+              help='Parse and score candidates in N processes')
 @click.pass_context
-def run(ctx, ignore, same_sex):
+def run(ctx, ignore, same_sex, full_search, single_pass, incremental, prerank, workers):
     """Start application and run menu"""
     if 'age' in ignore:
         ctx.obj['ignore_age'] = True
     if 'city' in ignore:
         ctx.obj['ignore_city'] = True
     ctx.obj['same_sex'] = same_sex
+    ctx.obj['full_search'] = full_search
+    ctx.obj['single_pass'] = single_pass
+    ctx.obj['incremental'] = incremental
+    ctx.obj['prerank'] = prerank
+    ctx.obj['workers'] = workers
     vkinder = app.startup(ctx.obj)
-    menu.run(vkinder)
+    try:
+        menu.run(vkinder)
+    finally:
+        vkinder.close()
 
 
 @cli.command()
@@ -50,6 +91,13 @@ def cleardb():
         os.remove(dbpath)
 
 
+@cli.command()
+def clearcache():
+    """Delete cached API responses"""
+    if os.path.exists(cachepath):
+        os.remove(cachepath)
+
+
 @cli.command()
 def cleartoken():
     """Delete saved token"""
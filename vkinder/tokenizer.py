@@ -0,0 +1,57 @@
+"""
+Interest tokenizer.
+
+Splits interest strings in tokens the same way :func:`vkinder.utils.cleanup`
+does, with the expressions compiled once. The same strings ("музыка",
+"кино", ...) come up in thousands of profiles, so tokenized strings are
+kept in a bounded LRU cache. Tokens are interned and returned as tuples,
+so cached results are safely shared between matches.
+"""
+import re
+import sys
+from functools import lru_cache
+
+from . import config
+
+CACHE_SIZE = config.getint('Match Settings', 'TokenCache')
+
+# Meaningless characters are dropped. A regular expression does it faster
+# than `str.translate`, which is slow on non-ASCII (e.g. Cyrillic) text.
+SPECIAL_CHARACTERS = re.compile(r'[\"^;!/|()«»]')
+
+
+def normalize(text):
+    """
+    :param text: Text string
+    :return: Tuple of interned lowercase tokens
+    """
+    # Newlines separate tokens like commas
+    text = SPECIAL_CHARACTERS.sub('', text).replace('\n', ',').lower()
+
+    return tuple(map(sys.intern, [token.strip() for token in text.split(',')]))
+
+
+class Tokenizer:
+
+    def __init__(self, cache_size=CACHE_SIZE):
+        self._tokenize = lru_cache(maxsize=cache_size)(normalize)
+
+    def tokenize(self, text):
+        """
+        :param text: Text string
+        :return: Tuple of tokens
+        """
+        return self._tokenize(text)
+
+    def tokenize_many(self, texts):
+        """
+        :param texts: Iterable of text strings, e.g. one interest field of every match
+        :return: List of tuples of tokens
+        """
+        return list(map(self._tokenize, texts))
+
+    def cache_info(self):
+        return self._tokenize.cache_info()
+
+
+tokenizer = Tokenizer()
@@ -0,0 +1,166 @@
+"""
+HTTP transports used by :class:`vkinder.api.VKApi` to reach the VK API.
+
+A transport knows nothing about VK: it takes a url and a dictionary
+of form parameters, POSTs them and returns a response object exposing
+`status_code`, `content`, `json()` and `raise_for_status()`.
+"""
+import gzip
+import json
+import threading
+from collections import defaultdict, deque
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import vkinder.utils as utils
+from . import config
+from .exceptions import CassetteError
+
+POOL_SIZE = config.getint('Transport', 'PoolSize')
+CONNECT_TIMEOUT = config.getfloat('Transport', 'ConnectTimeout')
+READ_TIMEOUT = config.getfloat('Transport', 'ReadTimeout')
+
+
+class Transport:
+    """Base class for all transports."""
+
+    def post(self, url, data):
+        """
+        Sends form parameters to the url.
+
+        :param url: Full method url
+        :param data: Dictionary of request parameters
+        :return: Response object
+        """
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class SessionTransport(Transport):
+    """
+    Keeps a pool of keep-alive connections, so consecutive
+    requests reuse an already established TCP+TLS connection
+    instead of opening a new one every time.
+    """
+
+    def __init__(self, pool_size=POOL_SIZE,
+                 connect_timeout=CONNECT_TIMEOUT,
+                 read_timeout=READ_TIMEOUT):
+        self.timeout = (connect_timeout, read_timeout)
+        self.session = requests.Session()
+
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def post(self, url, data):
+        return self.session.post(url, data=data, timeout=self.timeout)
+
+    def close(self):
+        self.session.close()
+
+
+class Response:
+    """Minimal stand-in for :class:`requests.Response`."""
+
+    def __init__(self, content, status_code=200):
+        self.content = content
+        self.status_code = status_code
+
+    def json(self):
+        return json.loads(self.content)
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f'{self.status_code} Error', response=self)
+
+
+class LocalTransport(Transport):
+    """
+    Routes requests to a local handler instead of the network.
+    Useful for tests and for running against a fake VK endpoint.
+
+    The handler is called as `handler(method, params)`, where method
+    is the last part of the url (e.g. `users.get`), and returns
+    a JSON-serializable VK API reply (`{'response': ...}` or `{'error': ...}`).
+    """
+
+    def __init__(self, handler):
+        self.handler = handler
+
+    def post(self, url, data):
+        method = url.rsplit('/', 1)[-1]
+        reply = self.handler(method, dict(data))
+        return Response(json.dumps(reply, ensure_ascii=False).encode('utf8'))
+
+
+class RecordingTransport(Transport):
+    """
+    Passes requests to another transport and writes every
+    request/response pair to a cassette file.
+
+    Cassette is a gzipped file of JSON lines, one pair per line.
+    Access tokens are never written to it.
+    """
+
+    def __init__(self, transport, path):
+        self.transport = transport
+        self.file = gzip.open(path, 'wt', encoding='utf8')
+        self._lock = threading.Lock()
+
+    def post(self, url, data):
+        response = self.transport.post(url, data)
+
+        record = {'method': url.rsplit('/', 1)[-1],
+                  'params': utils.normalize_params(data),
+                  'status': response.status_code,
+                  'body': response.content.decode('utf8')}
+
+        with self._lock:
+            self.file.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+        return response
+
+    def close(self):
+        self.file.close()
+        self.transport.close()
+
+
+class ReplayTransport(Transport):
+    """
+    Answers requests from a cassette written by :class:`RecordingTransport`,
+    without network access.
+
+    Requests are matched by method and parameters. Responses to the same
+    request are replayed in the recorded order, the last one is repeated
+    once they run out.
+    """
+
+    def __init__(self, path):
+        self.tape = defaultdict(deque)
+        self._lock = threading.Lock()
+
+        with gzip.open(path, 'rt', encoding='utf8') as f:
+            for line in f:
+                record = json.loads(line)
+                key = record['method'], record['params']
+                self.tape[key].append((record['status'], record['body']))
+
+    def post(self, url, data):
+        key = url.rsplit('/', 1)[-1], utils.normalize_params(data)
+
+        with self._lock:
+            if not (responses := self.tape.get(key)):
+                raise CassetteError(f'Request is not in the cassette: {key[0]} {key[1]}')
+            status, body = responses.popleft() if len(responses) > 1 else responses[0]
+
+        return Response(body.encode('utf8'), status)
@@ -1,9 +1,13 @@
 import os
 import pickle
+import sys
+import zlib
+from array import array
 from datetime import datetime
 
 import vkinder.utils as utils
 from . import config, Y, END, resources
+from .tokenizer import tokenizer
 
 # VK user object item fields -> :class:`User` attributes mapping
 user_map = {'general': config['General User'],
@@ -163,8 +167,55 @@ class User:
     def full_name(self):
         return f'{self.name} {self.surname}'
 
+    def compile(self):
+        """
+        :return: :class:`MatchModel` to score matches against the user
+        """
+        return MatchModel(self)
+
+
+class MatchModel:
+    """
+    User data prepared for scoring, built once per user.
+
+    Interest tokens and groups are kept as frozen sets, so scoring
+    a match never rebuilds them, and personal fields are packed
+    in a tuple. Every interest token is coded by a number in
+    `vocabulary` for vectorized scoring (see :mod:`vkinder.scoring`).
+    """
+
+    def __init__(self, user):
+        self.uid = user.uid
+
+        self.interests = tuple((field, frozenset(map(sys.intern, tokens)))
+                               for field, tokens in user.interests.items())
+        self.vocabulary = tuple((field, {token: code for code, token in enumerate(tokens)})
+                                for field, tokens in self.interests)
+        self.personal = tuple(user.personal.items())
+        self.groups = frozenset(user.groups)
+        # Fingerprint of the groups, see `Match.groups_hash`
+        self.groups_hash = zlib.crc32(array('q', sorted(self.groups)).tobytes())
+
+    def __repr__(self):
+        return f'MatchModel {self.uid}'
+
 
 class Match:
+    """
+    Candidate scored against the current user.
+
+    Tens of thousands of matches can be built in one search, so they're
+    kept compact: no per-instance `__dict__`, groups ids in a 64 bit
+    integer array and interest tokens in tuples of interned strings.
+
+    Groups checked for membership hold only the ones shared with the user
+    and carry `groups_hash` of the user's groups they were checked against.
+    Complete groups lists carry None.
+    """
+
+    __slots__ = ('uid', 'name', 'surname', 'common_friends', 'interests', 'personal',
+                 'groups', 'groups_hash', 'photos', 'score', 'interests_score',
+                 'personal_score', 'friends_score', 'groups_score')
 
     def __init__(self, uid,
                  name,
@@ -181,7 +232,8 @@ class Match:
         self.common_friends = common_friends
         self.interests = interests
         self.personal = personal
-        self.groups = groups
+        self.groups = array('q', groups)
+        self.groups_hash = None
         self.photos = photos
 
         self.score = 0
@@ -200,7 +252,22 @@ class Match:
                    general['name'],
                    general['surname'],
                    general['common_friends'],
-                   personal, interests, groups, photos)
+                   interests, personal, groups, photos)
+
+    @classmethod
+    def from_database(cls, db_match):
+        interests = pickle.loads(db_match.interests)
+        personal = pickle.loads(db_match.personal)
+        groups = pickle.loads(db_match.groups)
+        photos = [{'link': photo.link} for photo in db_match.photos]
+
+        match = cls(db_match.uid,
+                    db_match.name,
+                    db_match.surname,
+                    db_match.common_friends, interests, personal, groups, photos)
+        match.groups_hash = db_match.groups_hash
+
+        return match
 
     @classmethod
     def parse(cls, info):
@@ -226,8 +293,7 @@ class Match:
                 if category == 'personal':
                     personal[cls_attr] = value
                 elif category == 'interests':
-                    clean_value = utils.cleanup(value)
-                    interests[cls_attr] = clean_value
+                    interests[cls_attr] = tokenizer.tokenize(value)
                 else:
                     general[cls_attr] = value
 
@@ -244,6 +310,9 @@ class Match:
         return f"https://vk.com/id{self.uid}"
 
     def scoring(self, model):
+        """
+        :param model: :class:`MatchModel` of the current user
+        """
         self.interests_score = self._score_interests(model)
         self.personal_score = self._score_personal(model)
         self.friends_score = self._score_friends()
@@ -252,19 +321,17 @@ class Match:
     def _score_interests(self, model):
         interests_score = 0
 
-        for field in model.interests:
-            user_value = model.interests[field]
+        for field, user_value in model.interests:
             match_value = self.interests.get(field, None)
             if match_value:
-                field_score = INTERESTS_FACTOR * utils.common(match_value, user_value)
+                field_score = INTERESTS_FACTOR * len(user_value.intersection(match_value))
                 interests_score += field_score
         return interests_score
 
     def _score_personal(self, model):
         personal_score = 0
 
-        for field in model.personal:
-            user_value = model.personal[field]
+        for field, user_value in model.personal:
             match_value = self.personal.get(field, None)
             if match_value == user_value:
                 personal_score += PERSONAL_FACTOR * 1
@@ -280,6 +347,6 @@ class Match:
     def _score_groups(self, model):
         groups_score = 0
 
-        groups_score += GROUPS_FACTOR * utils.common(self.groups, model.groups)
+        groups_score += GROUPS_FACTOR * len(model.groups.intersection(self.groups))
 
         return groups_score
@@ -1,10 +1,13 @@
+import calendar
+import gc
+import json
 import os
 import re
 import sys
+from datetime import date
+from types import ModuleType
 
-import progressbar
-
-from . import config, END, V, B
+from . import config
 
 # VK photo sizes map (from biggest to smallest)
 photo_sizes = {k: int(v) for k, v in config['Photo Sizes'].items()}
@@ -69,6 +72,62 @@ def flatten(d):
     return flat
 
 
+def chunked(iterable, size):
+    """
+    Splits any iterable, including a lazy one, in lists of `size` items.
+
+    :param iterable: Iterable to split
+    :param size: Amount of items yielded per iteration
+    """
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def total_size(objects):
+    """
+    Measures memory held by a batch of objects. Every object they refer to,
+    directly or not, is counted once, so the objects shared within the batch
+    (e.g. interned strings) don't inflate the total. Classes and modules
+    aren't counted.
+
+    :param objects: Iterable of objects
+    :return: Size in bytes
+    """
+    seen = set()
+    stack = list(objects)
+    size = 0
+
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen or isinstance(obj, (type, ModuleType)):
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        stack.extend(gc.get_referents(obj))
+
+    return size
+
+
+def normalize_params(params):
+    """
+    Serializes request parameters so that equal requests give equal strings
+    regardless of parameters order and value types. The access token is left out.
+
+    :param params: Dictionary of request parameters
+    :return: JSON string
+    """
+    normalized = {name: str(value) for name, value in params.items()
+                  if name != 'access_token'}
+
+    return json.dumps(normalized, sort_keys=True, ensure_ascii=False)
+
+
 def next_ids(ids, amount=12):
     """
     Splits a list of matches ids in chunks.
@@ -80,6 +139,43 @@ def next_ids(ids, amount=12):
         yield ids[index:index + amount]
 
 
+def read_tokens(path):
+    """
+    Reads VK access tokens from a file, one per line.
+    Empty lines and lines starting with # are skipped.
+
+    :param path: Path to the tokens file
+    :return: List of tokens
+    """
+    with open(path, encoding='utf8') as f:
+        lines = (line.strip() for line in f)
+        return [line for line in lines if line and not line.startswith('#')]
+
+
+def split_search(criteria, today=None):
+    """
+    Splits `users.search` criteria into narrower shards along birth date facets:
+    birth year first, then birth month, then birth day.
+
+    :param criteria: Dictionary of `users.search` parameters
+    :param today: Date used to convert age bounds into birth years
+    :return: List of criteria dictionaries, empty if the criteria can't be split
+    """
+    today = today or date.today()
+
+    if 'birth_year' not in criteria:
+        first = today.year - criteria.get('age_to', 100) - 1
+        last = today.year - criteria.get('age_from', 14)
+        return [{**criteria, 'birth_year': year} for year in range(first, last + 1)]
+    elif 'birth_month' not in criteria:
+        return [{**criteria, 'birth_month': month} for month in range(1, 13)]
+    elif 'birth_day' not in criteria:
+        days = calendar.monthrange(criteria['birth_year'], criteria['birth_month'])[1]
+        return [{**criteria, 'birth_day': day} for day in range(1, days + 1)]
+
+    return []
+
+
 def verify_bday(value):
     """
     Validates if a given string conforms to the format used for find_age function.
@@ -94,20 +190,6 @@ def verify_bday(value):
         return True if verification else False
 
 
-def progress_bar(text):
-    bar = \
-        progressbar.ProgressBar(widgets=[f'{B}{text}{END}',
-                                         progressbar.Percentage(),
-                                         progressbar.Bar(
-                                             marker=progressbar.AnimatedMarker(
-                                                 fill='#', fill_wrap=(f'{V}', f'{END}'),
-                                                 marker_wrap=(f'{V}', f'{END}'))
-                                         )
-                                         ],
-                                redirect_stdout=True)
-    return bar
-
-
 def target_sex(user_sex, same_sex):
     if not same_sex:
         if user_sex == 2:
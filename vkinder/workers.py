@@ -0,0 +1,105 @@
+"""
+Process pool for the CPU bound part of building matches.
+
+Parsing profiles and scoring matches are sharded across worker processes.
+The match model of the current user is shipped to every worker once,
+when the worker starts, and results come back in the order of the input,
+so the matches and their scores are the same as with serial processing.
+
+Workers are started with the `spawn` method: the pipeline runs its stages
+in threads, and forking a process with threads running is unsafe.
+"""
+import math
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from .scoring import BatchScorer
+from .types import Match
+
+# Match model of the current user, set in every worker process
+_model = None
+
+
+def _init(model):
+    global _model
+    _model = model
+
+
+def _parse(profiles, groups):
+    return [Match.from_api(profile, match_groups, [])
+            for profile, match_groups in zip(profiles, groups)]
+
+
+def _score(matches):
+    BatchScorer(_model).score(matches)
+
+    return [(match.interests_score, match.personal_score,
+             match.friends_score, match.groups_score) for match in matches]
+
+
+class WorkerPool:
+
+    def __init__(self, workers, model):
+        """
+        :param workers: Amount of worker processes
+        :param model: :class:`vkinder.types.MatchModel` to score matches against
+        """
+        self.workers = workers
+        self.executor = ProcessPoolExecutor(workers,
+                                            mp_context=multiprocessing.get_context('spawn'),
+                                            initializer=_init, initargs=(model,))
+        # Futures not done yet, cancelled on close
+        self.pending = set()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        # `shutdown(cancel_futures=True)` needs Python 3.9
+        for future in list(self.pending):
+            future.cancel()
+        self.executor.shutdown()
+
+    def parse(self, profiles, groups):
+        """
+        :param profiles: List of VK `User` objects
+        :param groups: List of matches groups
+        :return: List of :class:`vkinder.types.Match` objects
+        """
+        shards = zip(self._shards(profiles), self._shards(groups))
+        futures = [self._submit(_parse, *shard) for shard in shards]
+
+        return [match for future in futures for match in future.result()]
+
+    def score(self, matches):
+        """
+        Sets the score components of every match.
+
+        :param matches: List of :class:`vkinder.types.Match` objects
+        :return: The same list
+        """
+        futures = [self._submit(_score, shard) for shard in self._shards(matches)]
+        scores = (score for future in futures for score in future.result())
+
+        for match, (interests, personal, friends, groups) in zip(matches, scores):
+            match.interests_score = interests
+            match.personal_score = personal
+            match.friends_score = friends
+            match.groups_score = groups
+
+        return matches
+
+    def _submit(self, function, *args):
+        future = self.executor.submit(function, *args)
+        self.pending.add(future)
+        future.add_done_callback(self.pending.discard)
+
+        return future
+
+    def _shards(self, items):
+        """Splits a list in one shard per worker."""
+        size = math.ceil(len(items) / self.workers) or 1
+        return [items[index:index + size] for index in range(0, len(items), size)]